@@ -1,6 +1,15 @@
 import os
 from flask import Flask
 from .database import db
+from .cache import post_cache, token_cache, credential_cache
+from .compress import compress
+from .tokens import signed_tokens
+from .search import post_search
+from .names import post_names
+from .writer import post_writer
+from .replicas import replica_router
+from .api.admission import admission
+from .api.idempotency import idempotency
 from flask_login import LoginManager
 
 
@@ -18,6 +27,17 @@ def create_app():
         db.create_all()
 
     login.init_app(app)
+    post_cache.init_app(app)
+    token_cache.init_app(app)
+    credential_cache.init_app(app)
+    compress.init_app(app)
+    signed_tokens.init_app(app)
+    post_search.init_app(app)
+    post_names.init_app(app)
+    post_writer.init_app(app)
+    replica_router.init_app(app)
+    admission.init_app(app)
+    idempotency.init_app(app)
 
     """
     if app.debug:
@@ -34,6 +54,9 @@ def create_app():
     import app.api.views as api
     app.register_blueprint(api.bp)
 
+    import app.api.internal as internal
+    app.register_blueprint(internal.bp)
+
     import app.auth.routes as auth
     app.register_blueprint(auth.bp)
 
@@ -0,0 +1,137 @@
+import threading
+from flask import request
+
+
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+ENVIRON_KEY = 'app.admission_budgets'
+
+
+class Budget(object):
+    """
+    Ограничение числа одновременно обрабатываемых запросов с короткой
+    очередью ожидания. Если очередь полна или место не освободилось
+    за timeout секунд - запрос отклоняется.
+    """
+
+    def __init__(self, name, limit, queue_size, timeout):
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            if self.in_flight >= self.limit:
+                if self.waiting >= self.queue_size:
+                    self.rejected += 1
+                    return False
+                self.waiting += 1
+                try:
+                    admitted = self._cond.wait_for(
+                                lambda: self.in_flight < self.limit,
+                                self.timeout
+                    )
+                finally:
+                    self.waiting -= 1
+                if not admitted:
+                    self.rejected += 1
+                    return False
+            self.in_flight += 1
+            self.admitted += 1
+            return True
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            return {
+                    'limit': self.limit,
+                    'in_flight': self.in_flight,
+                    'waiting': self.waiting,
+                    'admitted': self.admitted,
+                    'rejected': self.rejected
+            }
+
+
+class AdmissionController(object):
+    """
+    Контроль нагрузки на blueprint api в пределах процесса: отдельные
+    лимиты для чтения и записи (API_ADMISSION_LIMITS) и для отдельных
+    endpoint'ов (API_ADMISSION_ENDPOINT_LIMITS). Запрос, для которого
+    нет места, сразу получает 503 с Retry-After, а не ждет в очереди
+    воркера. Занятые места хранятся в WSGI environ запроса, поэтому
+    вложенные запросы (POST /api/batch) их не освобождают.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.retry_after = 1
+        self.budgets = {}
+        self.endpoint_budgets = {}
+
+    def init_app(self, app):
+        config = app.config
+        self.enabled = config['API_ADMISSION_ENABLED']
+        self.retry_after = config['API_ADMISSION_RETRY_AFTER']
+        queue_size = config['API_ADMISSION_QUEUE_SIZE']
+        timeout = config['API_ADMISSION_QUEUE_TIMEOUT']
+        self.budgets = {
+            name: Budget(name, limit, queue_size, timeout)
+            for name, limit in config['API_ADMISSION_LIMITS'].items()
+        }
+        self.endpoint_budgets = {
+            name: Budget(name, limit, queue_size, timeout)
+            for name, limit in config['API_ADMISSION_ENDPOINT_LIMITS'].items()
+        }
+
+    def budgets_for(self, endpoint, method):
+        kind = 'read' if method in READ_METHODS else 'write'
+        budgets = []
+        if endpoint in self.endpoint_budgets:
+            budgets.append(self.endpoint_budgets[endpoint])
+        if kind in self.budgets:
+            budgets.append(self.budgets[kind])
+        return budgets
+
+    def admit(self):
+        """
+        Занимает место для текущего запроса. Возвращает False, если
+        запрос нужно отклонить.
+        """
+        budgets = request.environ[ENVIRON_KEY] = []
+        if not self.enabled:
+            return True
+        for budget in self.budgets_for(request.endpoint, request.method):
+            if not budget.acquire():
+                self.release()
+                return False
+            budgets.append(budget)
+        return True
+
+    def release(self):
+        for budget in request.environ.pop(ENVIRON_KEY, []):
+            budget.release()
+
+    def stats(self):
+        return {
+                'enabled': self.enabled,
+                'budgets': {
+                    name: budget.stats()
+                    for name, budget in self.budgets.items()
+                },
+                'endpoints': {
+                    name: budget.stats()
+                    for name, budget in self.endpoint_budgets.items()
+                }
+        }
+
+
+admission = AdmissionController()
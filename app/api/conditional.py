@@ -0,0 +1,98 @@
+import hashlib
+import re
+from flask import current_app, request
+from sqlalchemy import func
+from app.compress import available_encodings, encoded_etag
+from app.database import db
+from app.models import Post, PostCount
+from app.counts import CHANGES
+from app.api.serializers import POST_FIELDS
+
+
+POST_ETAG_RE = re.compile(r'^(\d+)-(\d+)(?:-|$)')
+
+
+def make_etag(*parts):
+    raw = '\x1f'.join(str(part) for part in parts)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def post_last_modified(post):
+    return post.updated or post.timestamp
+
+
+def post_etag(id, version, fields=POST_FIELDS):
+    """
+    ETag поста - "<id>-<version>", для неполного набора полей к нему
+    добавляется хэш списка полей. Версия из ETag проверяется в If-Match.
+    """
+    etag = '{}-{}'.format(id, version)
+    if tuple(fields) != POST_FIELDS:
+        etag += '-' + make_etag(*fields)[:8]
+    return etag
+
+
+def if_match_versions(id):
+    """
+    Версии поста, перечисленные в If-Match (только сильные ETag). None -
+    условия нет (заголовка нет или If-Match: *).
+    """
+    if not request.if_match or request.if_match.star_tag:
+        return None
+    versions = set()
+    for etag in request.if_match.as_set():
+        match = POST_ETAG_RE.match(etag)
+        if match and int(match.group(1)) == id:
+            versions.add(int(match.group(2)))
+    return versions
+
+
+def collection_etag():
+    """
+    ETag коллекции постов вычисляется по счетчику изменений коллекции
+    (см. record_post_change) и максимумам по индексированным id и
+    updated - без загрузки и подсчета строк. Путь и параметры запроса
+    входят в ETag, так как каждая страница и каждый фильтр - отдельное
+    представление.
+    """
+    changes = db.session.query(PostCount.count).filter(
+                                    PostCount.user_id == CHANGES).as_scalar()
+    changes, max_id, max_updated = db.session.query(
+                                        changes,
+                                        func.max(Post.id),
+                                        func.max(Post.updated)
+    ).one()
+    return make_etag(
+                    'posts',
+                    changes,
+                    max_id,
+                    max_updated,
+                    request.full_path
+    )
+
+
+def is_not_modified(etag, last_modified=None):
+    if request.if_none_match:
+        candidates = [etag] + [
+            encoded_etag(etag, encoding) for encoding in available_encodings()
+        ]
+        return any(
+            request.if_none_match.contains_weak(candidate)
+            for candidate in candidates
+        )
+    if last_modified is not None and request.if_modified_since is not None:
+        since = request.if_modified_since.replace(tzinfo=None)
+        return last_modified.replace(microsecond=0) <= since
+    return False
+
+
+def set_validators(response, etag, last_modified=None):
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    return response
+
+
+def not_modified(etag, last_modified=None):
+    response = current_app.response_class(status=304)
+    return set_validators(response, etag, last_modified)
@@ -0,0 +1,208 @@
+import hashlib
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy.exc import IntegrityError
+from app.cache import LRUCache
+from app.database import db
+
+
+REPLAY_HEADERS = ('Content-Type', 'Location', 'ETag', 'Preference-Applied')
+
+
+def request_fingerprint(method, path, body):
+    return hashlib.sha256(b'\x00'.join([
+                                        method.encode('utf-8'),
+                                        path.encode('utf-8'),
+                                        body
+    ])).hexdigest()
+
+
+class IdempotencyStore(LRUCache):
+    """
+    Ответы на запросы с заголовком Idempotency-Key: повтор запроса с тем
+    же ключом получает сохраненный ответ без обращения к таблице posts.
+    Ключ действует в пределах пользователя, отпечаток (метод, путь,
+    тело) должен совпадать. Ответы хранятся в LRU кэше процесса
+    (IDEMPOTENCY_SIZE записей на IDEMPOTENCY_TTL секунд), а при
+    IDEMPOTENCY_DB = True еще и в таблице idempotency_keys, общей для
+    всех процессов: там же запрос с ключом резервируется на время
+    выполнения (не дольше IDEMPOTENCY_LOCK_TTL секунд). Ответы 5xx не
+    сохраняются, такой запрос можно повторить.
+    """
+
+    def __init__(self):
+        super(IdempotencyStore, self).__init__('IDEMPOTENCY')
+        self.use_db = False
+        self.lock_ttl = 0
+        self.purge_interval = 0
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._purged = 0
+        self.replays = 0
+
+    def init_app(self, app):
+        super(IdempotencyStore, self).init_app(app)
+        self.use_db = app.config['IDEMPOTENCY_DB']
+        self.lock_ttl = app.config['IDEMPOTENCY_LOCK_TTL']
+        self.purge_interval = app.config['IDEMPOTENCY_PURGE_INTERVAL']
+        with self._pending_lock:
+            self._pending = {}
+        self._purged = 0
+        self.replays = 0
+
+    def begin(self, user_id, key, fingerprint):
+        """
+        Возвращает (состояние, запись): 'new' - запрос нужно выполнить
+        (ключ зарезервирован), 'replay' - есть сохраненный ответ,
+        'mismatch' - ключ уже использован с другим запросом,
+        'in_flight' - запрос с этим ключом еще выполняется.
+        """
+        record = self.get((user_id, key))
+        if record is None and self.use_db:
+            record = self.load(user_id, key)
+        if record is not None:
+            return self.check(record, fingerprint)
+        with self._pending_lock:
+            pending = self._pending.get((user_id, key))
+            if pending is not None:
+                return self.check({'fingerprint': pending}, fingerprint)
+            self._pending[(user_id, key)] = fingerprint
+        if self.use_db and not self.reserve(user_id, key, fingerprint):
+            with self._pending_lock:
+                self._pending.pop((user_id, key), None)
+            record = self.load(user_id, key)
+            if record is None:
+                return 'in_flight', None
+            return self.check(record, fingerprint)
+        return 'new', None
+
+    def check(self, record, fingerprint):
+        if record['fingerprint'] != fingerprint:
+            return 'mismatch', None
+        if record.get('status') is None:
+            return 'in_flight', None
+        self.replays += 1
+        return 'replay', record
+
+    def finish(self, user_id, key, fingerprint, response):
+        if response.status_code >= 500:
+            self.abandon(user_id, key)
+            return
+        record = {
+                'fingerprint': fingerprint,
+                'status': response.status_code,
+                'headers': {
+                    name: response.headers[name]
+                    for name in REPLAY_HEADERS if name in response.headers
+                },
+                'body': response.get_data(as_text=True)
+        }
+        self.set((user_id, key), record)
+        if self.use_db:
+            table = self.table()
+            with db.engine.begin() as connection:
+                connection.execute(
+                    table.update()
+                    .where(table.c.user_id == user_id)
+                    .where(table.c.key == key)
+                    .values(
+                        status=record['status'],
+                        response=json.dumps({
+                            'headers': record['headers'],
+                            'body': record['body']
+                        }),
+                        expires_at=datetime.utcnow() +
+                        timedelta(seconds=self.ttl)
+                    )
+                )
+        with self._pending_lock:
+            self._pending.pop((user_id, key), None)
+
+    def abandon(self, user_id, key):
+        if self.use_db:
+            table = self.table()
+            with db.engine.begin() as connection:
+                connection.execute(
+                    table.delete()
+                    .where(table.c.user_id == user_id)
+                    .where(table.c.key == key)
+                    .where(table.c.status.is_(None))
+                )
+        with self._pending_lock:
+            self._pending.pop((user_id, key), None)
+
+    def table(self):
+        from app.models import IdempotencyKey
+        return IdempotencyKey.__table__
+
+    def load(self, user_id, key):
+        table = self.table()
+        with db.engine.connect() as connection:
+            row = connection.execute(
+                table.select()
+                .where(table.c.user_id == user_id)
+                .where(table.c.key == key)
+                .where(table.c.expires_at > datetime.utcnow())
+            ).first()
+        if row is None:
+            return None
+        record = {'fingerprint': row.fingerprint, 'status': row.status}
+        if row.status is not None:
+            record.update(json.loads(row.response))
+            self.set((user_id, key), record)
+        return record
+
+    def reserve(self, user_id, key, fingerprint):
+        """
+        Резервирует ключ в таблице. False - ключ уже занят другим
+        запросом (возможно, в другом процессе).
+        """
+        self.purge()
+        table = self.table()
+        now = datetime.utcnow()
+        with db.engine.begin() as connection:
+            # просроченная запись с тем же ключом больше не действует
+            connection.execute(
+                table.delete()
+                .where(table.c.user_id == user_id)
+                .where(table.c.key == key)
+                .where(table.c.expires_at <= now)
+            )
+        try:
+            with db.engine.begin() as connection:
+                connection.execute(table.insert().values(
+                    user_id=user_id,
+                    key=key,
+                    fingerprint=fingerprint,
+                    expires_at=now + timedelta(seconds=self.lock_ttl)
+                ))
+        except IntegrityError:
+            return False
+        return True
+
+    def purge(self):
+        """
+        Удаляет просроченные ключи, не чаще раза в
+        IDEMPOTENCY_PURGE_INTERVAL секунд.
+        """
+        now = time.monotonic()
+        if now - self._purged < self.purge_interval:
+            return
+        self._purged = now
+        table = self.table()
+        with db.engine.begin() as connection:
+            connection.execute(table.delete().where(
+                                table.c.expires_at <= datetime.utcnow()))
+
+    def stats(self):
+        stats = super(IdempotencyStore, self).stats()
+        with self._pending_lock:
+            stats['in_flight'] = len(self._pending)
+        stats['replays'] = self.replays
+        stats['db'] = self.use_db
+        return stats
+
+
+idempotency = IdempotencyStore()
@@ -0,0 +1,64 @@
+from flask import Blueprint, current_app, g, jsonify
+from app.api.admission import admission
+from app.api.views import bad_request, multi_auth
+from app.archive import archive_stats
+from app.api.idempotency import idempotency
+from app.cache import post_cache, token_cache, credential_cache
+from app.names import post_names
+from app.writer import post_writer
+from app.database import db, pool_stats
+from app.models import User
+from app.replicas import replica_router
+
+
+bp = Blueprint('internal', __name__, url_prefix='/api/_internal')
+
+
+@bp.before_request
+@multi_auth.login_required
+def require_internal_user():
+    """
+    Служебная статистика доступна только пользователям из
+    API_INTERNAL_USERS (по имени), остальным - 403.
+    """
+    username = db.session.query(User.username).filter(
+                                    User.id == g.current_user.id).scalar()
+    if username not in current_app.config['API_INTERNAL_USERS']:
+        status_code = 403
+        message = 'Permission error!'
+        return bad_request(status_code, message)
+
+
+@bp.route('/cache', methods=['GET'])
+def cache_stats():
+    return jsonify({
+                    'post_cache': post_cache.stats(),
+                    'token_cache': token_cache.stats(),
+                    'credential_cache': credential_cache.stats(),
+                    'name_filter': post_names.stats(),
+                    'idempotency': idempotency.stats()
+    })
+
+
+@bp.route('/admission', methods=['GET'])
+def admission_stats():
+    return jsonify(admission.stats())
+
+
+@bp.route('/writer', methods=['GET'])
+def writer_stats():
+    return jsonify(post_writer.stats())
+
+
+@bp.route('/db', methods=['GET'])
+def db_stats():
+    stats = {'default': pool_stats(db.engine)}
+    for bind in current_app.config['DB_REPLICA_BINDS']:
+        stats[bind] = pool_stats(db.get_engine(current_app, bind))
+    stats['replicas'] = replica_router.stats()
+    return jsonify(stats)
+
+
+@bp.route('/archive', methods=['GET'])
+def archive_run_stats():
+    return jsonify(archive_stats())
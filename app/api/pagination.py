@@ -0,0 +1,79 @@
+import base64
+import json
+from datetime import datetime
+from flask import current_app, request, url_for
+from sqlalchemy import and_, or_
+
+
+CURSOR_TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+class CursorError(ValueError):
+    pass
+
+
+def encode_cursor(timestamp, id):
+    raw = json.dumps([timestamp.strftime(CURSOR_TIMESTAMP_FORMAT), id])
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode('ascii'))
+        timestamp, id = json.loads(raw.decode('utf-8'))
+        timestamp = datetime.strptime(timestamp, CURSOR_TIMESTAMP_FORMAT)
+        id = int(id)
+    except (ValueError, TypeError, UnicodeError):
+        raise CursorError('invalid cursor')
+    return timestamp, id
+
+
+def get_limit():
+    default = current_app.config['API_POSTS_PER_PAGE']
+    maximum = current_app.config['API_POSTS_MAX_PER_PAGE']
+    try:
+        limit = int(request.args.get('limit', default))
+    except ValueError:
+        raise CursorError('limit must be a positive integer')
+    if limit < 1:
+        raise CursorError('limit must be a positive integer')
+    return min(limit, maximum)
+
+
+def apply_cursor(query, timestamp_column, id_column, cursor=None):
+    if cursor is not None:
+        timestamp, id = decode_cursor(cursor)
+        query = query.filter(or_(
+                    timestamp_column > timestamp,
+                    and_(timestamp_column == timestamp, id_column > id)
+        ))
+    return query.order_by(timestamp_column, id_column)
+
+
+def keyset_page(query, timestamp_column, id_column, limit, cursor=None):
+    """
+    Возвращает страницу (limit строк) отсортированную по (timestamp, id)
+    и курсор следующей страницы (None если страница последняя).
+    Стоимость запроса не зависит от "глубины" страницы.
+    """
+    query = apply_cursor(query, timestamp_column, id_column, cursor)
+    rows = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(last.timestamp, last.id)
+    return rows, next_cursor
+
+
+def set_link_header(response, endpoint, next_cursor, limit, **kwargs):
+    if next_cursor is None:
+        return response
+    args = request.args.to_dict()
+    args.update(kwargs)
+    args['cursor'] = next_cursor
+    args['limit'] = limit
+    next_url = url_for(endpoint, _external=True, **args)
+    response.headers['Link'] = '<{}>; rel="next"'.format(next_url)
+    response.headers['X-Next-Cursor'] = next_cursor
+    return response
@@ -0,0 +1,106 @@
+import json
+from flask import current_app, request
+from app.models import Post
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+POST_FIELDS = ('id', 'timestamp', 'user_id', 'name', 'content')
+
+WEEKDAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+MONTHS = (
+        'Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
+        'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'
+)
+
+
+def format_timestamp(value):
+    """
+    Форматирует datetime (UTC) так же, как JSONEncoder flask'а
+    ('Sat, 18 Oct 2026 10:12:31 GMT'), но без промежуточного
+    time.struct_time и не зависит от локали.
+    """
+    if value is None:
+        return None
+    return '%s, %02d %s %04d %02d:%02d:%02d GMT' % (
+                                            WEEKDAYS[value.weekday()],
+                                            value.day,
+                                            MONTHS[value.month - 1],
+                                            value.year,
+                                            value.hour,
+                                            value.minute,
+                                            value.second
+    )
+
+
+def requested_fields():
+    """
+    Список полей поста из параметра ?fields=id,name,... (sparse
+    fieldsets). Без параметра возвращаются все поля.
+    """
+    value = request.args.get('fields')
+    if not value:
+        return POST_FIELDS
+    fields = []
+    for field in value.split(','):
+        field = field.strip()
+        if field not in POST_FIELDS:
+            raise ValueError('unknown field: {}'.format(field))
+        if field not in fields:
+            fields.append(field)
+    return tuple(fields)
+
+
+def post_columns(fields, *extra, model=Post):
+    """
+    Колонки поста для Query; model - Post или ArchivedPost.
+    """
+    names = fields + tuple(name for name in extra if name not in fields)
+    return [getattr(model, name) for name in names]
+
+
+def serialize_post(row, fields=POST_FIELDS):
+    """
+    Словарь с полями поста. row - кортеж колонок из Query
+    (db.session.query(*post_columns(...))) или объект Post.
+    """
+    data = {field: getattr(row, field) for field in fields}
+    if 'timestamp' in data:
+        data['timestamp'] = format_timestamp(data['timestamp'])
+    return data
+
+
+def dumps(obj):
+    """
+    Сериализация в JSON: orjson, если установлен и не отключен через
+    API_JSON_ENCODER = 'json', иначе стандартный модуль json.
+    """
+    sort_keys = current_app.config['JSON_SORT_KEYS']
+    encoder = current_app.config['API_JSON_ENCODER']
+    if orjson is not None and encoder != 'json':
+        option = orjson.OPT_SORT_KEYS if sort_keys else 0
+        return orjson.dumps(obj, option=option)
+    return json.dumps(
+                    obj,
+                    ensure_ascii=current_app.config['JSON_AS_ASCII'],
+                    sort_keys=sort_keys,
+                    separators=(',', ':')
+    )
+
+
+def dumps_line(obj):
+    data = dumps(obj)
+    if isinstance(data, bytes):
+        return data + b'\n'
+    return data + '\n'
+
+
+def json_response(obj, status=200):
+    return current_app.response_class(
+                                    dumps(obj),
+                                    status=status,
+                                    mimetype='application/json'
+    )
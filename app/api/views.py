@@ -1,9 +1,32 @@
-from flask import Blueprint, request, url_for, jsonify
-from app.models import Post, User
-from app.database import db
+from functools import wraps
+from flask import Blueprint, request, url_for, jsonify, json, Response, \
+    stream_with_context, abort
+from app.models import ArchivedPost, Post, User
+from app.database import db, begin_transaction
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
+from datetime import datetime, timezone
+from dateutil.parser import isoparse
+from app.cache import post_cache
+from app.search import post_search
+from app.counts import adjust_post_counts, get_post_count, \
+    record_post_change
+from app.archive import archive_enabled, is_archived
+from app.names import name_hash, post_names
+from app.writer import GroupCommitTimeout, post_writer
+from werkzeug.exceptions import HTTPException
 from werkzeug.http import HTTP_STATUS_CODES
-from flask import g
+from flask import g, current_app
 from flask_httpauth import HTTPBasicAuth, HTTPTokenAuth, MultiAuth
+from app.api.admission import admission
+from app.api.idempotency import idempotency, request_fingerprint
+from app.api.conditional import post_etag, post_last_modified, \
+    collection_etag, is_not_modified, not_modified, set_validators, \
+    if_match_versions
+from app.api.serializers import POST_FIELDS, requested_fields, \
+    post_columns, serialize_post, dumps_line, json_response
+from app.api.pagination import CursorError, get_limit, keyset_page, \
+    apply_cursor, set_link_header
 
 
 bp = Blueprint('api', __name__, url_prefix='/api')
@@ -13,6 +36,21 @@ token_auth = HTTPTokenAuth()
 multi_auth = MultiAuth(basic_auth, token_auth)
 
 
+@bp.before_request
+def admit_request():
+    if not admission.admit():
+        status_code = 503
+        message = 'Server is overloaded, retry later'
+        response = bad_request(status_code, message)
+        response.headers['Retry-After'] = str(admission.retry_after)
+        return response
+
+
+@bp.teardown_request
+def release_request(exc):
+    admission.release()
+
+
 @basic_auth.verify_password
 def verify_password(username, password):
     user = User.query.filter_by(username=username).first()
@@ -47,6 +85,38 @@ def bad_request(status_code=400, message=None):
     return response
 
 
+def requested_preference():
+    """
+    Разбирает заголовок Prefer (RFC 7240) и возвращает 'minimal' или
+    'representation', если клиент указал return=..., иначе None.
+    """
+    for preference in request.headers.get('Prefer', '').split(','):
+        name, _, value = preference.split(';')[0].partition('=')
+        value = value.strip().strip('"').lower()
+        if name.strip().lower() == 'return' and \
+                value in ('minimal', 'representation'):
+            return value
+    return None
+
+
+def return_preference():
+    """
+    Предпочтение return из заголовка Prefer или значение по умолчанию
+    из конфигурации.
+    """
+    return requested_preference() or current_app.config['API_PREFER_RETURN']
+
+
+def apply_preference(response, preference):
+    """
+    Preference-Applied выставляется, только если клиент сам указал
+    return=... в Prefer.
+    """
+    if requested_preference() is not None:
+        response.headers['Preference-Applied'] = 'return=' + preference
+    return response
+
+
 @bp.route('/tokens', methods=['POST'])
 @basic_auth.login_required
 def get_token():
@@ -63,67 +133,447 @@ def revoke_token():
     return '', 204
 
 
+@bp.route('/posts/search', methods=['GET'])
+def search_posts():
+    query = request.args.get('q', '').strip()
+    if not query:
+        return bad_request(400, 'must include q parameter')
+    try:
+        fields = requested_fields()
+        limit = get_limit()
+    except ValueError as e:
+        return bad_request(400, str(e))
+    hits = post_search.search(query, limit)
+    rows = db.session.query(*post_columns(fields, 'id')).filter(
+                                    Post.id.in_([id for id, _ in hits]))
+    rows = {row.id: row for row in rows}
+    data = []
+    for id, score in hits:
+        if id not in rows:
+            post_search.remove_post(id)
+            continue
+        item = serialize_post(rows[id], fields)
+        item['score'] = round(score, 4)
+        data.append(item)
+    return json_response(data)
+
+
 @bp.route('/posts/<int:id>', methods=['GET'])
 def get_post(id):
-    post = Post.query.get_or_404(id)
-    data = {
-            'id': post.id,
-            'timestamp': post.timestamp,
-            'user_id': post.user_id,
-            'name': post.name,
-            'content': post.content
-    }
-    return jsonify(data)
+    try:
+        fields = requested_fields()
+    except ValueError as e:
+        return bad_request(400, str(e))
+    cached = post_cache.get(id)
+    if cached is not None:
+        data, version, last_modified = cached
+        data = {field: data[field] for field in fields}
+    else:
+        row = db.session.query(
+                    *post_columns(fields, 'updated', 'timestamp', 'version')
+        ).filter(Post.id == id).first()
+        if row is None and archive_enabled():
+            row = db.session.query(*post_columns(
+                                    fields,
+                                    'updated',
+                                    'timestamp',
+                                    'version',
+                                    model=ArchivedPost
+            )).filter(ArchivedPost.id == id).first()
+        if row is None:
+            abort(404)
+        data = serialize_post(row, fields)
+        version = row.version
+        last_modified = post_last_modified(row)
+        # Прочитанное с реплики может отставать - в кэш не кладется
+        if fields == POST_FIELDS and g.get('db_replica') is None:
+            post_cache.set(id, (data, version, last_modified))
+    etag = post_etag(id, version, fields)
+    if is_not_modified(etag, last_modified):
+        return not_modified(etag, last_modified)
+    return set_validators(json_response(data), etag, last_modified)
+
+
+def wants_ndjson():
+    if request.args.get('stream', type=int):
+        return True
+    best = request.accept_mimetypes.best_match(
+                            ['application/json', 'application/x-ndjson']
+    )
+    return best == 'application/x-ndjson'
+
+
+def parse_datetime(value):
+    """
+    Дата и время в формате ISO 8601; время с часовым поясом
+    переводится в UTC, как хранится timestamp.
+    """
+    timestamp = isoparse(value)
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return timestamp
+
+
+def filter_posts(query, model=Post):
+    user_id = request.args.get('user_id')
+    if user_id is not None:
+        query = query.filter(model.user_id == int(user_id))
+    since = request.args.get('since')
+    if since is not None:
+        query = query.filter(model.timestamp >= parse_datetime(since))
+    until = request.args.get('until')
+    if until is not None:
+        query = query.filter(model.timestamp < parse_datetime(until))
+    return query
+
+
+def with_archive(query, fields, user_id=None):
+    """
+    Добавляет к выборке постов архивные (UNION ALL) с теми же
+    фильтрами. Курсор, сортировка и LIMIT применяются к объединению:
+    колонки Post в них SQLAlchemy подставляет из подзапроса.
+    """
+    if not archive_enabled():
+        return query
+    archived = filter_posts(db.session.query(*post_columns(
+                                                fields,
+                                                'timestamp',
+                                                'id',
+                                                model=ArchivedPost
+    )), ArchivedPost)
+    if user_id is not None:
+        archived = archived.filter(ArchivedPost.user_id == user_id)
+    return query.union_all(archived)
+
+
+def total_count(user_id=None):
+    """
+    Значение X-Total-Count из таблицы счетчиков. Для выборок по времени
+    счетчиков нет - возвращается None.
+    """
+    if 'since' in request.args or 'until' in request.args:
+        return None
+    filter_id = request.args.get('user_id', type=int)
+    if filter_id is not None:
+        if user_id is not None and user_id != filter_id:
+            return 0
+        user_id = filter_id
+    return get_post_count(user_id)
+
+
+def stream_posts(query, fields):
+    try:
+        query = apply_cursor(
+                        query,
+                        Post.timestamp,
+                        Post.id,
+                        request.args.get('cursor')
+        )
+    except CursorError as e:
+        return bad_request(400, str(e))
+    batch_size = current_app.config['API_STREAM_BATCH_SIZE']
+
+    def generate():
+        for row in query.yield_per(batch_size):
+            yield dumps_line(serialize_post(row, fields))
+
+    return Response(
+                    stream_with_context(generate()),
+                    mimetype='application/x-ndjson'
+    )
+
+
+def list_posts(query, endpoint, **kwargs):
+    """
+    Общая часть GET /api/posts и GET /api/users/<id>/posts: фильтры
+    user_id/since/until, выбор полей, архивные посты, потоковая
+    выгрузка, ETag и keyset-пагинация.
+    """
+    try:
+        fields = requested_fields()
+        query = with_archive(filter_posts(query.with_entities(
+                                *post_columns(fields, 'timestamp', 'id'))),
+                             fields,
+                             kwargs.get('id'))
+    except ValueError as e:
+        return bad_request(400, str(e))
+    if wants_ndjson():
+        return stream_posts(query, fields)
+    etag = collection_etag()
+    if is_not_modified(etag):
+        return not_modified(etag)
+    if request.args.get('all', type=int):
+        posts = query.order_by(Post.timestamp, Post.id).all()
+        next_cursor = limit = None
+    else:
+        try:
+            limit = get_limit()
+            posts, next_cursor = keyset_page(
+                                    query,
+                                    Post.timestamp,
+                                    Post.id,
+                                    limit,
+                                    request.args.get('cursor')
+            )
+        except CursorError as e:
+            return bad_request(400, str(e))
+    data = [serialize_post(post, fields) for post in posts]
+    response = set_validators(json_response(data), etag)
+    total = total_count(kwargs.get('id'))
+    if total is not None:
+        response.headers['X-Total-Count'] = str(total)
+    return set_link_header(response, endpoint, next_cursor, limit, **kwargs)
 
 
 @bp.route('/posts', methods=['GET'])
 def get_posts():
-    data = []
-    posts = Post.query.all()
-    for post in posts:
-        data.append({
-                    'id': post.id,
-                    'timestamp': post.timestamp,
-                    'user_id': post.user_id,
-                    'name': post.name,
-                    'content': post.content
-        })
-    return jsonify(data)
+    return list_posts(Post.query, 'api.get_posts')
+
+
+@bp.route('/users/<int:id>/posts', methods=['GET'])
+def get_user_posts(id):
+    user = User.query.get_or_404(id)
+    return list_posts(user.posts, 'api.get_user_posts', id=id)
+
+
+def name_conflict():
+    return bad_request(409, 'post with this name already exists')
+
+
+def insert_grouped(post):
+    """
+    Вставка через групповой commit. Пост не добавляется в сессию:
+    значения по умолчанию заполняются здесь, id приходит из пачки.
+    """
+    post.timestamp = post.updated = datetime.utcnow()
+    post.version = 1
+    post.id = post_writer.insert({
+                            'user_id': post.user_id,
+                            'name': post.name,
+                            'name_hash': post.name_hash,
+                            'content': post.content,
+                            'timestamp': post.timestamp,
+                            'updated': post.updated,
+                            'version': post.version
+    })
+
+
+def idempotent(view):
+    """
+    Поддержка заголовка Idempotency-Key: повтор запроса с тем же ключом
+    получает сохраненный ответ (с Idempotent-Replayed: true), тот же
+    ключ с другим запросом - 422, пока первый запрос выполняется - 409.
+    """
+    @wraps(view)
+    def decorated(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if not key or not idempotency.enabled:
+            return view(*args, **kwargs)
+        if len(key) > 255:
+            return bad_request(400, 'Idempotency-Key is too long')
+        fingerprint = request_fingerprint(
+                                        request.method,
+                                        request.path,
+                                        request.get_data()
+        )
+        user_id = g.current_user.id
+        state, record = idempotency.begin(user_id, key, fingerprint)
+        if state == 'replay':
+            response = current_app.response_class(
+                                            record['body'],
+                                            status=record['status'],
+                                            headers=record['headers']
+            )
+            response.headers['Idempotent-Replayed'] = 'true'
+            return response
+        if state == 'mismatch':
+            status_code = 422
+            message = 'Idempotency-Key was used with a different request'
+            return bad_request(status_code, message)
+        if state == 'in_flight':
+            status_code = 409
+            message = 'request with this Idempotency-Key is in progress'
+            return bad_request(status_code, message)
+        try:
+            response = current_app.make_response(view(*args, **kwargs))
+        except Exception:
+            idempotency.abandon(user_id, key)
+            raise
+        idempotency.finish(user_id, key, fingerprint, response)
+        return response
+    return decorated
 
 
 @bp.route('/posts', methods=['POST'])
 @multi_auth.login_required
+@idempotent
 def create_post():
     data = request.get_json() or {}
-    if ('name' not in data) or ('content' not in data):
+    if not isinstance(data, dict) or \
+            not isinstance(data.get('name'), str) or \
+            not isinstance(data.get('content'), str):
         status_code = 400
         message = 'must include name and content fields'
         return bad_request(status_code, message)
+    if post_names.is_taken(data['name']):
+        return name_conflict()
     post = Post()
     post.user_id = g.current_user.id
     post.name = data['name']
     post.content = data['content']
-    db.session.add(post)
-    db.session.commit()
-    data = {
-            'id': post.id,
-            'user_id': post.user_id,
-            'timestamp': post.timestamp,
-            'name': post.name,
-            'content': post.content
-    }
-    response = jsonify(data)
-    response.status_code = 201
+    try:
+        if post_writer.enabled and not g.get('batch_atomic'):
+            insert_grouped(post)
+        else:
+            db.session.add(post)
+            adjust_post_counts({post.user_id: 1})
+            db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return name_conflict()
+    except GroupCommitTimeout:
+        status_code = 503
+        message = 'post was not saved in time, retry later'
+        response = bad_request(status_code, message)
+        response.headers['Retry-After'] = str(admission.retry_after)
+        return response
+    post_names.add(post.name_hash)
+    post_search.index_post(post.id, post.name, post.content)
+    preference = return_preference()
+    if preference == 'minimal':
+        response = current_app.response_class(status=201)
+    else:
+        response = json_response(serialize_post(post), 201)
     response.headers['Location'] = url_for('api.get_post', id=post.id)
-    return response
+    return apply_preference(response, preference)
+
+
+def read_batch_items():
+    if request.mimetype == 'application/x-ndjson':
+        lines = request.get_data(as_text=True).splitlines()
+        return [json.loads(line) for line in lines if line.strip()]
+    return request.get_json(force=True, silent=True)
+
+
+def ids_by_hash(hashes, chunk_size=500):
+    ids = {}
+    for i in range(0, len(hashes), chunk_size):
+        chunk = hashes[i:i + chunk_size]
+        rows = db.session.query(Post.name_hash, Post.id).filter(
+                                                Post.name_hash.in_(chunk))
+        ids.update(rows)
+    return ids
+
+
+@bp.route('/posts/batch', methods=['POST'])
+@multi_auth.login_required
+def create_posts_batch():
+    try:
+        items = read_batch_items()
+    except ValueError:
+        return bad_request(400, 'body must be a JSON array or NDJSON')
+    if not isinstance(items, list) or not items:
+        return bad_request(400, 'body must be a non-empty list of posts')
+    if len(items) > current_app.config['API_BATCH_MAX_SIZE']:
+        return bad_request(413, 'too many posts in one batch')
+    name_length = Post.__table__.c.name.type.length
+    content_length = Post.__table__.c.content.type.length
+    results = []
+    for item in items:
+        if not isinstance(item, dict) or \
+                not isinstance(item.get('name'), str) or \
+                not isinstance(item.get('content'), str):
+            message = 'must include name and content fields'
+        elif len(item['name']) > name_length or \
+                len(item['content']) > content_length:
+            message = 'name must be at most {} and content at most {} ' \
+                'characters'.format(name_length, content_length)
+        else:
+            results.append(None)
+            continue
+        results.append({
+                'status': 400,
+                'error': HTTP_STATUS_CODES[400],
+                'message': message
+        })
+    if any(results):
+        for i, result in enumerate(results):
+            if result is None:
+                results[i] = {'status': 424, 'error': HTTP_STATUS_CODES[424]}
+        return json_response(results, 400)
+    taken = post_names.taken([item['name'] for item in items])
+    rows = []
+    for i, item in enumerate(items):
+        if item['name'] in taken:
+            results[i] = {
+                    'status': 409,
+                    'error': HTTP_STATUS_CODES[409],
+                    'message': 'post with this name already exists'
+            }
+            continue
+        taken.add(item['name'])
+        rows.append({
+                    'user_id': g.current_user.id,
+                    'name': item['name'],
+                    'name_hash': name_hash(item['name']),
+                    'content': item['content'],
+                    'version': 1
+        })
+    if rows:
+        try:
+            db.session.execute(Post.__table__.insert(), rows)
+            hash_ids = ids_by_hash([row['name_hash'] for row in rows])
+            ids = {row['name']: hash_ids[row['name_hash']] for row in rows}
+            adjust_post_counts({g.current_user.id: len(rows)})
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            status_code = 409
+            message = 'conflicting concurrent insert, retry the batch'
+            return bad_request(status_code, message)
+    post_names.add(*[row['name_hash'] for row in rows])
+    for row in rows:
+        post_search.index_post(ids[row['name']], row['name'], row['content'])
+    for i, item in enumerate(items):
+        if results[i] is None:
+            id = ids[item['name']]
+            results[i] = {
+                    'status': 201,
+                    'id': id,
+                    'location': url_for('api.get_post', id=id)
+            }
+    status_code = 201 if len(rows) == len(items) else 207
+    return json_response(results, status_code)
+
+
+def post_missing(id):
+    """
+    Поста нет в таблице posts: архивный пост изменить нельзя (409),
+    иначе 404.
+    """
+    if is_archived(id):
+        status_code = 409
+        message = 'post is archived and read-only'
+        return bad_request(status_code, message)
+    abort(404)
+
+
+def precondition_failed():
+    status_code = 412
+    message = 'post has been modified, fetch it again'
+    return bad_request(status_code, message)
 
 
 @bp.route('/posts/<int:id>', methods=['PUT'])
 @multi_auth.login_required
 def update_post(id):
-    post = Post.query.get_or_404(id)
+    post = Post.query.get(id)
+    if post is None:
+        return post_missing(id)
     data = request.get_json() or {}
-    if ('name' not in data) or ('content' not in data):
+    if not isinstance(data, dict) or \
+            not isinstance(data.get('name'), str) or \
+            not isinstance(data.get('content'), str):
         status_code = 400
         message = 'must include name and content fields'
         return bad_request(status_code, message)
@@ -131,43 +581,311 @@ def update_post(id):
         status_code = 403
         message = 'Permission error!'
         return bad_request(status_code, message)
+    versions = if_match_versions(id)
+    if versions is not None and post.version not in versions:
+        return precondition_failed()
+    if post_names.is_taken(data['name'], exclude_id=id):
+        return name_conflict()
     post.name = data['name']
     post.content = data['content']
-    db.session.commit()
-    data = {
-            'id': post.id,
-            'timestamp': post.timestamp,
-            'user_id': post.user_id,
-            'name': post.name,
-            'content': post.content
-    }
-    response = jsonify(data)
-    response.status_code = 201
+    try:
+        record_post_change()
+        db.session.commit()
+    except StaleDataError:
+        db.session.rollback()
+        return precondition_failed()
+    except IntegrityError:
+        db.session.rollback()
+        return name_conflict()
+    post_names.add(post.name_hash)
+    post_cache.delete(id)
+    post_search.index_post(post.id, post.name, post.content)
+    preference = return_preference()
+    if preference == 'minimal':
+        response = current_app.response_class(status=204)
+    else:
+        response = json_response(serialize_post(post), 201)
     response.headers['Location'] = url_for('api.get_post', id=post.id)
-    return response
+    response.set_etag(post_etag(post.id, post.version))
+    return apply_preference(response, preference)
 
 
-@bp.route('/posts/<int:id>', methods=['DELETE'])
-@multi_auth.login_required
-def delete_post(id):
-    post = Post.query.get_or_404(id)
-    if post.user_id != g.current_user.id:
+RETURNING_DIALECTS = ('postgresql',)
+
+
+def execute_write(stmt):
+    """
+    Выполняет UPDATE/DELETE поста одним запросом. Если СУБД
+    поддерживает RETURNING, возвращает и измененную строку.
+    Результат - (число строк, строка или None).
+    """
+    if db.engine.dialect.name not in RETURNING_DIALECTS:
+        return db.session.execute(stmt).rowcount, None
+    table = Post.__table__
+    columns = [table.c[name] for name in POST_FIELDS + ('version',)]
+    row = db.session.execute(stmt.returning(*columns)).first()
+    return int(row is not None), row
+
+
+def write_failed(id):
+    """
+    Запрос не изменил ни одной строки: дополнительный запрос
+    отличает несуществующий (404) или архивный (409) пост, чужой пост
+    (403) и несовпадение версии из If-Match (412).
+    """
+    db.session.rollback()
+    user_id = db.session.query(Post.user_id).filter(Post.id == id).first()
+    if user_id is None:
+        return post_missing(id)
+    if user_id[0] != g.current_user.id:
         status_code = 403
         message = 'Permission error!'
         return bad_request(status_code, message)
-    db.session.delete(post)
+    return precondition_failed()
+
+
+def where_own_post(stmt, id):
+    table = Post.__table__
+    stmt = stmt.where(table.c.id == id).where(
+                                    table.c.user_id == g.current_user.id)
+    versions = if_match_versions(id)
+    if versions is not None:
+        stmt = stmt.where(table.c.version.in_(versions))
+    return stmt
+
+
+@bp.route('/posts/<int:id>', methods=['PATCH'])
+@multi_auth.login_required
+def patch_post(id):
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        data = {}
+    values = {
+        field: data[field] for field in ('name', 'content') if field in data
+    }
+    if not values or \
+            not all(isinstance(value, str) for value in values.values()):
+        status_code = 400
+        message = 'must include name or content field'
+        return bad_request(status_code, message)
+    if 'name' in values:
+        if post_names.is_taken(values['name'], exclude_id=id):
+            return name_conflict()
+        values['name_hash'] = name_hash(values['name'])
+    table = Post.__table__
+    stmt = where_own_post(table.update(), id).values(
+                                        version=table.c.version + 1,
+                                        **values
+    )
+    try:
+        count, row = execute_write(stmt)
+        if not count:
+            return write_failed(id)
+        if row is None:
+            row = db.session.query(
+                            *post_columns(POST_FIELDS, 'version')
+            ).filter(Post.id == id).one()
+        record_post_change()
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return name_conflict()
+    if 'name_hash' in values:
+        post_names.add(values['name_hash'])
+    post_cache.delete(id)
+    post_search.index_post(id, row.name, row.content)
+    preference = return_preference()
+    if preference == 'minimal':
+        response = current_app.response_class(status=204)
+    else:
+        response = json_response(serialize_post(row))
+    response.headers['Location'] = url_for('api.get_post', id=id)
+    response.set_etag(post_etag(id, row.version))
+    return apply_preference(response, preference)
+
+
+@bp.route('/posts/<int:id>', methods=['DELETE'])
+@multi_auth.login_required
+def delete_post(id):
+    preference = return_preference()
+    relist = current_app.config['API_DELETE_RELIST']
+    row = None
+    if preference != 'minimal' and not relist and \
+            db.engine.dialect.name not in RETURNING_DIALECTS:
+        # без RETURNING удаленный пост нужно прочитать заранее
+        row = db.session.query(*post_columns(POST_FIELDS)).filter(
+                                                    Post.id == id).first()
+    stmt = where_own_post(Post.__table__.delete(), id)
+    count, deleted = execute_write(stmt)
+    if not count:
+        return write_failed(id)
+    adjust_post_counts({g.current_user.id: -1})
     db.session.commit()
-    posts = Post.query.all()
-    data = []
-    for post in posts:
-        data.append({
-                     'id': post.id,
-                     'timestamp': post.timestamp,
-                     'user_id': post.user_id,
-                     'name': post.name,
-                     'content': post.content
-        })
-    response = jsonify(data)
-    response.status_code = 202
+    post_cache.delete(id)
+    post_search.remove_post(id)
+    if preference == 'minimal':
+        response = current_app.response_class(status=204)
+        return apply_preference(response, preference)
+    if not relist:
+        data = serialize_post(deleted or row)
+        return apply_preference(json_response(data), preference)
+    posts = db.session.query(*post_columns(POST_FIELDS)).order_by(Post.id)
+    data = [serialize_post(post) for post in posts]
+    response = json_response(data, 202)
     response.headers['Location'] = url_for('api.get_posts')
-    return response
+    return apply_preference(response, preference)
+
+
+BATCH_ENDPOINTS = (
+    'api.get_post',
+    'api.create_post',
+    'api.update_post',
+    'api.patch_post',
+    'api.delete_post'
+)
+BATCH_HEADERS = ('If-Match', 'If-None-Match', 'Prefer')
+
+
+def batch_error(status_code, message=None):
+    result = {
+            'status': status_code,
+            'body': {'error': HTTP_STATUS_CODES.get(status_code, 'Unknown')}
+    }
+    if message:
+        result['body']['message'] = message
+    return result
+
+
+def batch_result(response):
+    result = {'status': response.status_code}
+    for name in ('Location', 'ETag'):
+        if name in response.headers:
+            result[name.lower()] = response.headers[name]
+    if response.mimetype == 'application/json':
+        result['body'] = json.loads(response.get_data(as_text=True))
+    return result
+
+
+def run_operation(operation):
+    """
+    Выполняет одну операцию пакета как вложенный запрос к API. View
+    вызывается без повторной аутентификации (g.current_user уже
+    установлен). Возвращает (результат, id затронутого поста или None).
+    """
+    if not isinstance(operation, dict) or \
+            not isinstance(operation.get('path'), str):
+        return batch_error(400, 'operation must include path'), None
+    body = operation.get('body')
+    if body is not None and not isinstance(body, dict):
+        return batch_error(400, 'operation body must be an object'), None
+    method = str(operation.get('method', 'GET')).upper()
+    headers = operation.get('headers')
+    if not isinstance(headers, dict):
+        headers = {}
+    ctx = current_app.test_request_context(
+                    operation['path'],
+                    base_url=request.host_url,
+                    method=method,
+                    json=body,
+                    headers={
+                        name: headers[name]
+                        for name in BATCH_HEADERS if name in headers
+                    }
+    )
+    with ctx:
+        if request.routing_exception is not None:
+            return batch_error(request.routing_exception.code), None
+        if request.url_rule.endpoint not in BATCH_ENDPOINTS:
+            message = 'operation is not allowed in a batch'
+            return batch_error(400, message), None
+        view = current_app.view_functions[request.url_rule.endpoint]
+        view = getattr(view, '__wrapped__', view)
+        try:
+            response = current_app.make_response(view(**request.view_args))
+        except HTTPException as e:
+            return batch_error(e.code), None
+        except Exception:
+            # ошибка одной операции не должна ронять весь пакет; в
+            # атомарном режиме точку сохранения откатывает run_atomic
+            current_app.logger.exception('batch operation failed')
+            if not g.get('batch_atomic'):
+                db.session.rollback()
+            return batch_error(500), None
+        id = request.view_args.get('id')
+    result = batch_result(response)
+    if id is None and result['status'] == 201:
+        id = result.get('body', {}).get('id')
+    return result, id
+
+
+def refresh_posts(ids):
+    """
+    После отката пакета возвращает кэш и поисковый индекс к состоянию БД.
+    """
+    for id in ids:
+        post_cache.delete(id)
+        row = db.session.query(Post.name, Post.content).filter(
+                                                    Post.id == id).first()
+        if row is None:
+            post_search.remove_post(id)
+        else:
+            post_search.index_post(id, row.name, row.content)
+
+
+def run_atomic(operations):
+    """
+    Все операции - в одной транзакции: каждая выполняется в своей
+    точке сохранения (commit внутри view фиксирует только ее). Первая
+    неудачная операция откатывает весь пакет: она возвращает свою
+    ошибку, остальные - 424.
+    """
+    g.batch_atomic = True
+    begin_transaction()
+    results = []
+    touched = set()
+    for operation in operations:
+        savepoint = db.session.begin_nested()
+        result, id = run_operation(operation)
+        results.append(result)
+        if id is not None:
+            touched.add(id)
+        if result['status'] >= 400:
+            break
+        if savepoint.is_active:
+            savepoint.commit()
+    else:
+        db.session.commit()
+        return json_response(results)
+    if savepoint.is_active:
+        savepoint.rollback()
+    db.session.rollback()
+    refresh_posts(touched)
+    failed = len(results) - 1
+    message = 'operation {} failed, batch rolled back'.format(failed)
+    results = [
+        results[i] if i == failed else batch_error(424, message)
+        for i in range(len(operations))
+    ]
+    return json_response(results, results[failed]['status'])
+
+
+@bp.route('/batch', methods=['POST'])
+@multi_auth.login_required
+def batch():
+    data = request.get_json(force=True, silent=True)
+    if isinstance(data, list):
+        data = {'operations': data}
+    if not isinstance(data, dict) or \
+            not isinstance(data.get('operations'), list) or \
+            not data['operations']:
+        status_code = 400
+        message = 'body must include a non-empty list of operations'
+        return bad_request(status_code, message)
+    operations = data['operations']
+    if len(operations) > current_app.config['API_BATCH_MAX_OPERATIONS']:
+        return bad_request(413, 'too many operations in one batch')
+    if data.get('atomic', current_app.config['API_BATCH_ATOMIC']):
+        return run_atomic(operations)
+    results = [run_operation(operation)[0] for operation in operations]
+    failed = any(result['status'] >= 400 for result in results)
+    return json_response(results, 207 if failed else 200)
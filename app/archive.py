@@ -0,0 +1,106 @@
+import time
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import func, select
+from app.database import db
+from app.models import ArchiveRun, ArchivedPost, Post
+from app.counts import record_post_change
+from app.search import post_search
+
+
+def archive_enabled():
+    return current_app.config['ARCHIVE_ENABLED']
+
+
+def is_archived(id):
+    return db.session.query(ArchivedPost.id).filter(
+                                    ArchivedPost.id == id).first() is not None
+
+
+def archive_posts(days=None, batch_size=None):
+    """
+    Переносит посты старше days дней из posts в posts_archive пачками
+    по batch_size, от старых к новым. Каждая пачка - отдельная
+    транзакция: строки блокируются (SELECT ... FOR UPDATE), копируются
+    в архив и удаляются из posts, поэтому параллельное изменение поста
+    либо успевает до переноса, либо не находит его (409). Счетчики
+    постов не меняются - архивные посты тоже посты. Возвращает запись
+    ArchiveRun.
+    """
+    config = current_app.config
+    if days is None:
+        days = config['ARCHIVE_AFTER_DAYS']
+    if batch_size is None:
+        batch_size = config['ARCHIVE_BATCH_SIZE']
+    started_at = datetime.utcnow()
+    start = time.perf_counter()
+    cutoff = started_at - timedelta(days=days)
+    moved = batches = 0
+    while True:
+        count = archive_batch(cutoff, batch_size)
+        if not count:
+            break
+        moved += count
+        batches += 1
+        if count < batch_size:
+            break
+    run = ArchiveRun(
+                    started_at=started_at,
+                    cutoff=cutoff,
+                    moved=moved,
+                    batches=batches,
+                    duration_ms=int(1000 * (time.perf_counter() - start))
+    )
+    db.session.add(run)
+    db.session.commit()
+    return run
+
+
+def archive_batch(cutoff, batch_size):
+    posts = Post.__table__
+    archive = ArchivedPost.__table__
+    ids = [id for id, in db.session.query(Post.id).filter(
+                Post.timestamp < cutoff
+    ).order_by(Post.timestamp, Post.id).limit(batch_size).with_for_update()]
+    if not ids:
+        db.session.rollback()
+        return 0
+    names = [column.name for column in archive.columns]
+    db.session.execute(archive.insert().from_select(
+                names,
+                select([posts.c[name] for name in names])
+                .where(posts.c.id.in_(ids))
+    ))
+    db.session.execute(posts.delete().where(posts.c.id.in_(ids)))
+    record_post_change()
+    db.session.commit()
+    # поисковый индекс и его догрузка охватывают только posts
+    for id in ids:
+        post_search.remove_post(id)
+    return len(ids)
+
+
+def archive_stats():
+    config = current_app.config
+    moved, runs = db.session.query(
+                                func.coalesce(func.sum(ArchiveRun.moved), 0),
+                                func.count(ArchiveRun.id)
+    ).one()
+    last_runs = ArchiveRun.query.order_by(ArchiveRun.started_at.desc()).limit(
+                                            config['ARCHIVE_RUNS_SHOWN'])
+    return {
+            'enabled': config['ARCHIVE_ENABLED'],
+            'after_days': config['ARCHIVE_AFTER_DAYS'],
+            'moved': moved,
+            'runs': runs,
+            'last_runs': [
+                {
+                    'started_at': run.started_at.isoformat(),
+                    'cutoff': run.cutoff.isoformat(),
+                    'moved': run.moved,
+                    'batches': run.batches,
+                    'duration_ms': run.duration_ms
+                }
+                for run in last_runs
+            ]
+    }
@@ -0,0 +1,118 @@
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """
+    Ограниченный по размеру LRU кэш с временем жизни записей (TTL).
+    Кэш локален для процесса, потокобезопасен и ведет счетчики
+    попаданий, промахов и вытеснений. Параметры берутся из конфигурации
+    приложения: <PREFIX>_ENABLED, <PREFIX>_SIZE, <PREFIX>_TTL.
+    """
+
+    def __init__(self, config_prefix):
+        self.config_prefix = config_prefix
+        self.enabled = False
+        self.maxsize = 0
+        self.ttl = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def init_app(self, app):
+        self.enabled = app.config[self.config_prefix + '_ENABLED']
+        self.maxsize = app.config[self.config_prefix + '_SIZE']
+        self.ttl = app.config[self.config_prefix + '_TTL']
+        self.clear()
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            value, expires = item
+            if expires < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        if not self.enabled:
+            return
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def delete_value(self, value):
+        with self._lock:
+            items = self._data.items()
+            keys = [key for key, item in items if item[0] == value]
+            for key in keys:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def stats(self):
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                    'enabled': self.enabled,
+                    'size': len(self._data),
+                    'maxsize': self.maxsize,
+                    'ttl': self.ttl,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'hit_rate': self.hits / requests if requests else 0.0
+            }
+
+
+class CredentialCache(LRUCache):
+    """
+    Кэш успешных проверок пароля (HTTP Basic). Ключ - HMAC от имени
+    пользователя, хэша и пароля на случайном ключе процесса, поэтому
+    пароли в памяти не хранятся, а после смены пароля старые записи
+    не совпадут даже до их удаления. Значение - имя пользователя.
+    """
+
+    def init_app(self, app):
+        super(CredentialCache, self).init_app(app)
+        self.secret = os.urandom(32)
+
+    def key(self, username, password_hash, password):
+        message = '\x00'.join([username or '', password_hash, password])
+        return hmac.new(
+                        self.secret,
+                        message.encode('utf-8'),
+                        hashlib.sha256
+        ).digest()
+
+
+post_cache = LRUCache('POST_CACHE')
+token_cache = LRUCache('TOKEN_CACHE')
+credential_cache = CredentialCache('CREDENTIAL_CACHE')
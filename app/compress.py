@@ -0,0 +1,96 @@
+import gzip
+from flask import current_app, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def available_encodings():
+    """
+    Поддерживаемые кодировки в порядке предпочтения сервера.
+    br и zstd доступны, только если установлены brotli и zstandard.
+    """
+    encodings = []
+    if brotli is not None:
+        encodings.append('br')
+    if zstandard is not None:
+        encodings.append('zstd')
+    encodings.append('gzip')
+    return encodings
+
+
+def compress_data(data, encoding, config):
+    if encoding == 'br':
+        return brotli.compress(data, quality=config['COMPRESS_BR_LEVEL'])
+    if encoding == 'zstd':
+        compressor = zstandard.ZstdCompressor(
+                                        level=config['COMPRESS_ZSTD_LEVEL'])
+        return compressor.compress(data)
+    return gzip.compress(data, compresslevel=config['COMPRESS_LEVEL'])
+
+
+def encoded_etag(etag, encoding):
+    return '{}-{}'.format(etag, encoding)
+
+
+class Compress(object):
+    """
+    Сжатие ответов (gzip, а также br/zstd при наличии библиотек) по
+    заголовку Accept-Encoding. Не сжимаются маленькие ответы, потоковые
+    ответы, файлы (direct_passthrough) и уже сжатые данные. Сжатое
+    представление получает свой ETag (с суффиксом кодировки).
+    """
+
+    def init_app(self, app):
+        app.after_request(self.after_request)
+
+    def after_request(self, response):
+        config = current_app.config
+        if not config['COMPRESS_ENABLED']:
+            return response
+        if response.status_code == 304:
+            # у 304 нет тела и типа, но он должен нести тот же Vary, что
+            # и ответ 200 (RFC 7232, 4.1)
+            response.vary.add('Accept-Encoding')
+            return self.restore_encoded_etag(response)
+        if response.mimetype not in config['COMPRESS_MIMETYPES']:
+            return response
+        response.vary.add('Accept-Encoding')
+        if response.status_code < 200 or \
+                response.status_code in (204, 206) or \
+                response.direct_passthrough or \
+                response.is_streamed or \
+                'Content-Encoding' in response.headers:
+            return response
+        encoding = request.accept_encodings.best_match(available_encodings())
+        if encoding is None:
+            return response
+        data = response.get_data()
+        if len(data) < config['COMPRESS_MIN_SIZE']:
+            return response
+        response.set_data(compress_data(data, encoding, config))
+        response.headers['Content-Encoding'] = encoding
+        etag, weak = response.get_etag()
+        if etag:
+            response.set_etag(encoded_etag(etag, encoding), weak)
+        return response
+
+    def restore_encoded_etag(self, response):
+        etag, weak = response.get_etag()
+        if etag:
+            for encoding in available_encodings():
+                if request.if_none_match.contains_weak(
+                                            encoded_etag(etag, encoding)):
+                    response.set_etag(encoded_etag(etag, encoding), weak)
+                    break
+        return response
+
+
+compress = Compress()
@@ -0,0 +1,141 @@
+from collections import Counter
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import IntegrityError
+from app.database import db, begin_transaction
+from app.models import ArchivedPost, Post, PostCount, User
+
+
+TOTAL = 0
+# Строка post_counts со счетчиком изменений коллекции постов (ETag)
+CHANGES = -1
+
+
+def count_posts(user_id=None):
+    """
+    Число постов, включая архивные.
+    """
+    count = 0
+    for model in (Post, ArchivedPost):
+        query = db.session.query(func.count(model.id))
+        if user_id is not None:
+            query = query.filter(model.user_id == user_id)
+        count += query.scalar()
+    return count
+
+
+def adjust_post_counts(deltas):
+    """
+    Изменяет счетчики постов в текущей транзакции. deltas - словарь
+    {user_id: изменение}. Вызывается после добавления/удаления постов
+    и до commit: если строки счетчика еще нет, она создается со
+    значением COUNT(*), которое уже учитывает изменения транзакции.
+    Увеличивает и счетчик изменений коллекции.
+    """
+    changes = Counter()
+    for user_id, delta in deltas.items():
+        if user_id is not None:
+            changes[user_id] += delta
+        changes[TOTAL] += delta
+    db.session.flush()
+    for user_id, delta in changes.items():
+        if delta:
+            increment_counter(
+                user_id,
+                delta,
+                lambda: count_posts(None if user_id == TOTAL else user_id)
+            )
+    record_post_change()
+
+
+def record_post_change():
+    """
+    Увеличивает счетчик изменений коллекции постов в текущей
+    транзакции. Вызывается при создании, изменении, удалении и
+    архивации постов; по нему строится ETag списков.
+    """
+    increment_counter(CHANGES, 1, lambda: 1)
+
+
+def increment_counter(key, delta, initial):
+    """
+    Увеличивает счетчик key на delta. Если строки еще нет, она
+    создается со значением initial(). Два параллельных первых изменения
+    не конфликтуют: в PostgreSQL - INSERT ... ON CONFLICT DO UPDATE,
+    в остальных СУБД INSERT выполняется в SAVEPOINT и при нарушении
+    первичного ключа повторяется UPDATE.
+    """
+    table = PostCount.__table__
+    update = table.update().where(table.c.user_id == key).values(
+                                                count=table.c.count + delta)
+    if db.session.execute(update).rowcount:
+        return
+    value = initial()
+    if db.engine.dialect.name == 'postgresql':
+        stmt = pg_insert(table).values(user_id=key, count=value)
+        db.session.execute(stmt.on_conflict_do_update(
+                                    index_elements=[table.c.user_id],
+                                    set_={'count': table.c.count + delta}
+        ))
+        return
+    begin_transaction()
+    try:
+        with db.session.begin_nested():
+            db.session.execute(table.insert().values(
+                                                user_id=key,
+                                                count=value
+            ))
+    except IntegrityError:
+        db.session.execute(update)
+
+
+def get_post_count(user_id=None):
+    """
+    Число постов (всего или автора) из таблицы счетчиков. Пока счетчик
+    не создан - обычный COUNT(*).
+    """
+    key = TOTAL if user_id is None else user_id
+    count = db.session.query(PostCount.count).filter(
+                                        PostCount.user_id == key).scalar()
+    if count is None:
+        count = count_posts(user_id)
+    return count
+
+
+def reconcile_post_counts(batch_size=1000):
+    """
+    Пересчитывает счетчики по таблицам posts и posts_archive пачками
+    по batch_size авторов, каждая пачка - отдельная транзакция. Строки
+    счетчиков блокируются (SELECT ... FOR UPDATE) до подсчета, поэтому
+    параллельные создания и удаления постов не теряются.
+    Возвращает число обновленных счетчиков.
+    """
+    updated = 0
+    last_id = 0
+    while True:
+        ids = [id for id, in db.session.query(User.id).filter(
+                    User.id > last_id).order_by(User.id).limit(batch_size)]
+        if not ids:
+            break
+        last_id = ids[-1]
+        updated += reconcile_batch(ids)
+    updated += reconcile_batch([TOTAL])
+    return updated
+
+
+def reconcile_batch(user_ids):
+    db.session.query(PostCount).filter(
+                PostCount.user_id.in_(user_ids)).with_for_update().all()
+    if user_ids == [TOTAL]:
+        counts = {TOTAL: count_posts()}
+    else:
+        counts = dict.fromkeys(user_ids, 0)
+        for model in (Post, ArchivedPost):
+            for user_id, count in db.session.query(
+                            model.user_id, func.count(model.id)
+            ).filter(model.user_id.in_(user_ids)).group_by(model.user_id):
+                counts[user_id] += count
+    for user_id, count in counts.items():
+        db.session.merge(PostCount(user_id=user_id, count=count))
+    db.session.commit()
+    return len(counts)
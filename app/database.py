@@ -1,3 +1,189 @@
-from flask_sqlalchemy import SQLAlchemy
+import threading
+import time
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import orm
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.pool import NullPool, StaticPool
 
-db = SQLAlchemy()
+
+# Ключи профиля в SQLALCHEMY_ENGINE_OPTIONS, которые не являются
+# аргументами create_engine и переводятся в connect_args драйвера
+SESSION_OPTIONS = ('statement_timeout', 'lock_timeout', 'application_name')
+QUEUE_POOL_OPTIONS = ('pool_size', 'max_overflow', 'pool_timeout')
+
+
+class PoolTimer(object):
+    """
+    Счетчики пула соединений: сколько соединений выдано сейчас и всего,
+    суммарное и максимальное время ожидания соединения, число отказов
+    по pool_timeout.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checked_out = 0
+        self.acquired = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.timeouts = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                    'checked_out': self.checked_out,
+                    'acquired': self.acquired,
+                    'timeouts': self.timeouts,
+                    'avg_wait_ms': 1000 * self.total_wait / self.acquired
+                    if self.acquired else 0.0,
+                    'max_wait_ms': 1000 * self.max_wait
+            }
+
+
+class TimedPool(object):
+    """
+    Примесь к классу пула SQLAlchemy, измеряющая ожидание соединения.
+    """
+    timer = None
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super(TimedPool, self)._do_get()
+        except TimeoutError:
+            with self.timer.lock:
+                self.timer.timeouts += 1
+            raise
+        wait = time.perf_counter() - start
+        with self.timer.lock:
+            self.timer.checked_out += 1
+            self.timer.acquired += 1
+            self.timer.total_wait += wait
+            self.timer.max_wait = max(self.timer.max_wait, wait)
+        return connection
+
+    def _do_return_conn(self, connection):
+        with self.timer.lock:
+            self.timer.checked_out -= 1
+        return super(TimedPool, self)._do_return_conn(connection)
+
+
+def session_connect_args(dialect, options):
+    """
+    Таймауты запросов и блокировок (в миллисекундах) и имя приложения
+    в виде connect_args для конкретного драйвера. Что драйвер не
+    поддерживает - пропускается.
+    """
+    args = {}
+    statement_timeout = options.get('statement_timeout')
+    lock_timeout = options.get('lock_timeout')
+    application_name = options.get('application_name')
+    if dialect == 'postgresql':
+        settings = []
+        if statement_timeout:
+            settings.append('-c statement_timeout={}'.format(
+                                                        statement_timeout))
+        if lock_timeout:
+            settings.append('-c lock_timeout={}'.format(lock_timeout))
+        if settings:
+            args['options'] = ' '.join(settings)
+        if application_name:
+            args['application_name'] = application_name
+    elif dialect == 'mysql':
+        settings = []
+        if statement_timeout:
+            settings.append('max_execution_time={}'.format(
+                                                        statement_timeout))
+        if lock_timeout:
+            settings.append('innodb_lock_wait_timeout={}'.format(
+                                            max(1, lock_timeout // 1000)))
+        if settings:
+            args['init_command'] = 'SET SESSION ' + ', '.join(settings)
+    elif dialect == 'sqlite':
+        if lock_timeout:
+            args['timeout'] = lock_timeout / 1000
+    return args
+
+
+class RoutingSession(SignallingSession):
+    """
+    Сессия, которая в запросах только на чтение отправляет SELECT на
+    реплику, выбранную replica_router (см. app/replicas.py). Модели с
+    __bind_key__ и запросы при наличии несохраненных изменений идут
+    на свои движки как обычно.
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        from app.replicas import replica_router
+        engine = replica_router.engine_for(self, mapper)
+        if engine is not None:
+            return engine
+        return super(RoutingSession, self).get_bind(mapper, clause)
+
+
+class Database(SQLAlchemy):
+    """
+    SQLALCHEMY_ENGINE_OPTIONS - профиль, общий для всех СУБД: опции,
+    которые не подходят драйверу или пулу (pool_size для SQLite,
+    statement_timeout и т.п.), отбрасываются или переводятся в
+    connect_args. Пул каждого движка ведет счетчики ожидания
+    соединений (pool_stats).
+    """
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def create_engine(self, sa_url, engine_opts):
+        options = dict(engine_opts)
+        session_options = {
+            name: options.pop(name)
+            for name in SESSION_OPTIONS if name in options
+        }
+        dialect_cls = sa_url.get_dialect()
+        dialect = dialect_cls.name
+        connect_args = dict(options.get('connect_args') or {})
+        for name, value in session_connect_args(
+                                    dialect, session_options).items():
+            connect_args.setdefault(name, value)
+        if connect_args:
+            options['connect_args'] = connect_args
+        poolclass = options.get('poolclass') or \
+            dialect_cls.get_pool_class(sa_url)
+        if issubclass(poolclass, (NullPool, StaticPool)):
+            for name in QUEUE_POOL_OPTIONS:
+                options.pop(name, None)
+        options['poolclass'] = type(
+                                    'Timed' + poolclass.__name__,
+                                    (TimedPool, poolclass),
+                                    {'timer': PoolTimer()}
+        )
+        return super(Database, self).create_engine(sa_url, options)
+
+
+def pool_stats(engine):
+    pool = engine.pool
+    stats = {'pool': type(pool).__mro__[2].__name__}
+    for name in ('size', 'checkedin', 'overflow'):
+        if hasattr(pool, name):
+            stats[name] = getattr(pool, name)()
+    if 'checkedin' in stats:
+        stats['idle'] = stats.pop('checkedin')
+    if isinstance(pool, TimedPool):
+        stats.update(pool.timer.stats())
+    return stats
+
+
+db = Database()
+
+
+def begin_transaction():
+    """
+    Явно начинает транзакцию текущей сессии. Драйвер sqlite3 открывает
+    транзакцию только перед INSERT/UPDATE/DELETE, а SAVEPOINT вне
+    транзакции SQLite фиксирует сразу при RELEASE - без этого
+    вложенные транзакции (begin_nested) не откатываются вместе с
+    внешней.
+    """
+    connection = db.session.connection()
+    dbapi_connection = connection.connection.connection
+    if getattr(dbapi_connection, 'in_transaction', True) is False:
+        connection.execute('BEGIN')
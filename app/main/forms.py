@@ -1,5 +1,5 @@
 from flask_wtf import FlaskForm
-from wtforms import StringField, SubmitField, TextAreaField
+from wtforms import HiddenField, StringField, SubmitField, TextAreaField
 from wtforms.validators import DataRequired
 
 
@@ -15,3 +15,7 @@ class PostCreateForm(FlaskForm):
                         description="Content of the entity"
     )
     submit = SubmitField('Submit')
+
+
+class PostEditForm(PostCreateForm):
+    version = HiddenField()
@@ -6,10 +6,17 @@ from flask import (
     url_for,
 )
 from app.database import db
-from .forms import PostCreateForm
-from app.models import Post
+from app.cache import post_cache
+from app.search import post_search
+from app.counts import adjust_post_counts, record_post_change
+from app.names import post_names
+from app.archive import archive_enabled
+from .forms import PostCreateForm, PostEditForm
+from app.models import ArchivedPost, Post
 from flask_login import current_user, login_required
-from sqlalchemy import desc
+from sqlalchemy import desc, literal
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
 
 
 bp = Blueprint('main', __name__, url_prefix='/main')
@@ -19,35 +26,83 @@ bp = Blueprint('main', __name__, url_prefix='/main')
 def index():
     form = PostCreateForm()
     if form.validate_on_submit():
+        if post_names.is_taken(form.name.data):
+            flash('Post with this name already exists!')
+            return redirect(url_for('main.index'))
         post = Post(
                     user_id=current_user.id,
                     name=form.name.data,
                     content=form.content.data
         )
-        db.session.add(post)
-        db.session.commit()
+        try:
+            db.session.add(post)
+            adjust_post_counts({post.user_id: 1})
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            flash('Post with this name already exists!')
+            return redirect(url_for('main.index'))
+        post_names.add(post.name_hash)
+        post_search.index_post(post.id, post.name, post.content)
         flash('Your post is now live!')
         return redirect(url_for('main.index'))
-    posts = Post.query.order_by(desc(Post.timestamp)).all()
-    return render_template('main/index.html', form=form, posts=posts)
+    return render_template('main/index.html', form=form, posts=list_posts())
+
+
+LIST_COLUMNS = ('id', 'user_id', 'timestamp', 'name', 'content')
+
+
+def list_posts():
+    """
+    Посты для ленты, включая архивные (UNION ALL, как в списках API).
+    Архивные посты помечены archived - их нельзя изменить или удалить.
+    """
+    posts = db.session.query(
+            *[getattr(Post, name) for name in LIST_COLUMNS],
+            literal(False).label('archived')
+    )
+    if archive_enabled():
+        posts = posts.union_all(db.session.query(
+            *[getattr(ArchivedPost, name) for name in LIST_COLUMNS],
+            literal(True).label('archived')
+        ))
+    return posts.order_by(desc(Post.timestamp), desc(Post.id)).all()
 
 
 @bp.route('/edit/<int:id>', methods=['GET', 'POST'])
 @login_required
 def edit(id):
     post = Post.query.get_or_404(id)
-    form = PostCreateForm(
+    form = PostEditForm(
                     name=post.name,
-                    content=post.content
+                    content=post.content,
+                    version=post.version
     )
     if form.validate_on_submit():
-        if current_user.id == post.user_id:
+        if current_user.id != post.user_id:
+            flash('Permission error!')
+        elif str(form.version.data) != str(post.version):
+            flash('Post has been changed by someone else, try again!')
+        elif post_names.is_taken(form.name.data, exclude_id=id):
+            flash('Post with this name already exists!')
+        else:
             post.name = form.name.data
             post.content = form.content.data
-            db.session.commit()
+            try:
+                record_post_change()
+                db.session.commit()
+            except StaleDataError:
+                db.session.rollback()
+                flash('Post has been changed by someone else, try again!')
+                return redirect(url_for('main.index'))
+            except IntegrityError:
+                db.session.rollback()
+                flash('Post with this name already exists!')
+                return redirect(url_for('main.index'))
+            post_names.add(post.name_hash)
+            post_cache.delete(id)
+            post_search.index_post(post.id, post.name, post.content)
             flash('Your post is now edited!')
-        else:
-            flash('Permission error!')
         return redirect(url_for('main.index'))
     return render_template('main/edit.html', form=form)
 
@@ -58,7 +113,10 @@ def delete(id):
     post = Post.query.get_or_404(id)
     if current_user.id == post.user_id:
         db.session.delete(post)
+        adjust_post_counts({post.user_id: -1})
         db.session.commit()
+        post_cache.delete(id)
+        post_search.remove_post(id)
         flash('Your post is now deleted!')
     else:
         flash('Permission error!')
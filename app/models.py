@@ -3,6 +3,11 @@ from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin
 from app import login
+from app.cache import token_cache, credential_cache
+from app.tokens import signed_tokens
+from flask import current_app
+from sqlalchemy.orm import make_transient_to_detached, validates
+from app.names import name_hash
 import base64
 from datetime import datetime, timedelta
 import os
@@ -26,39 +31,192 @@ class User(UserMixin, db.Model):
         return '<User {}>'.format(self.username)
 
     def set_password(self, password):
+        credential_cache.delete_value(self.username)
         self.password_hash = generate_password_hash(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        key = credential_cache.key(self.username, self.password_hash, password)
+        if credential_cache.get(key) is not None:
+            return True
+        if not check_password_hash(self.password_hash, password):
+            return False
+        credential_cache.set(key, self.username)
+        return True
+
+    def snapshot(self):
+        return {c.name: getattr(self, c.name) for c in self.__table__.columns}
+
+    @staticmethod
+    def from_snapshot(values):
+        """
+        Восстанавливает пользователя из снимка колонок и добавляет его
+        в текущую сессию без запроса к БД.
+        """
+        user = User(**values)
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+
+    @staticmethod
+    def signed_tokens_enabled():
+        return current_app.config['API_TOKEN_BACKEND'] == 'signed'
 
     def get_token(self, expires_in=3600):
+        if User.signed_tokens_enabled():
+            return signed_tokens.issue(self.id, expires_in)
         now = datetime.utcnow()
         if self.token and self.token_expiration > now + timedelta(seconds=60):
             return self.token
+        if self.token:
+            token_cache.delete(self.token)
         self.token = base64.b64encode(os.urandom(24)).decode('utf-8')
         self.token_expiration = now + timedelta(seconds=expires_in)
         db.session.add(self)
         return self.token
 
     def revoke_token(self):
+        if User.signed_tokens_enabled():
+            signed_tokens.revoke(self.id)
+            return
+        token_cache.delete(self.token)
         self.token_expiration = datetime.utcnow() - timedelta(seconds=1)
 
     @staticmethod
     def check_token(token):
+        if User.signed_tokens_enabled():
+            user_id = signed_tokens.verify(token)
+            if user_id is None:
+                return None
+            return User.from_snapshot({'id': user_id})
+        now = datetime.utcnow()
+        cached = token_cache.get(token)
+        if cached is not None:
+            values, expiration = cached
+            if expiration < now:
+                token_cache.delete(token)
+                return None
+            return User.from_snapshot(values)
         user = User.query.filter_by(token=token).first()
-        if user is None or user.token_expiration < datetime.utcnow():
+        if user is None or user.token_expiration < now:
             return None
+        ttl = min(
+                token_cache.ttl,
+                (user.token_expiration - now).total_seconds()
+        )
+        token_cache.set(token, (user.snapshot(), user.token_expiration), ttl)
         return user
 
 
+class TokenRevocation(db.Model):
+    __tablename__ = 'token_revocations'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    revoked_at = db.Column(db.DateTime, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+
+class IdempotencyKey(db.Model):
+    """
+    Ключи идемпотентности POST /api/posts. status = NULL - запрос с
+    этим ключом еще выполняется, иначе response - сохраненный ответ.
+    """
+    __tablename__ = 'idempotency_keys'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    key = db.Column(db.String(255), primary_key=True)
+    fingerprint = db.Column(db.String(64), nullable=False)
+    status = db.Column(db.Integer)
+    response = db.Column(db.Text)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+
+class PostCount(db.Model):
+    """
+    Счетчики постов: user_id = 0 - всего постов, иначе - постов автора.
+    """
+    __tablename__ = 'post_counts'
+
+    user_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+
 class Post(db.Model):
     __tablename__ = 'posts'
+    __table_args__ = (
+        db.Index('ix_posts_user_id_timestamp', 'user_id', 'timestamp'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(1000), nullable=False, unique=True)
+    name = db.Column(db.String(1000), nullable=False)
+    name_hash = db.Column(
+                        db.String(64),
+                        nullable=False,
+                        index=True,
+                        unique=True
+    )
     content = db.Column(db.String(5000), nullable=False)
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
+    updated = db.Column(
+                        db.DateTime,
+                        index=True,
+                        default=datetime.utcnow,
+                        onupdate=datetime.utcnow
+    )
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    # Номер версии для оптимистичной блокировки: UPDATE выполняется с
+    # условием WHERE version = <прочитанная версия>, иначе StaleDataError
+    version = db.Column(db.Integer, nullable=False, server_default='1')
+
+    __mapper_args__ = {'version_id_col': version}
+
+    @validates('name')
+    def validate_name(self, key, name):
+        self.name_hash = name_hash(name)
+        return name
 
     def __str__(self):
         return self.name
+
+
+class ArchivedPost(db.Model):
+    """
+    Архив старых постов (см. app/archive.py): те же колонки, что у
+    posts, и только индексы, нужные для чтения. Архивные посты
+    доступны только для чтения.
+    """
+    __tablename__ = 'posts_archive'
+    __table_args__ = (
+        db.Index(
+                'ix_posts_archive_user_id_timestamp',
+                'user_id',
+                'timestamp'
+        ),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    name = db.Column(db.String(1000), nullable=False)
+    name_hash = db.Column(
+                        db.String(64),
+                        nullable=False,
+                        index=True,
+                        unique=True
+    )
+    content = db.Column(db.String(5000), nullable=False)
+    timestamp = db.Column(db.DateTime, index=True)
+    updated = db.Column(db.DateTime)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    version = db.Column(db.Integer, nullable=False, server_default='1')
+
+
+class ArchiveRun(db.Model):
+    """
+    Журнал запусков архивации: сколько постов перенесено и за сколько
+    пачек.
+    """
+    __tablename__ = 'archive_runs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    started_at = db.Column(db.DateTime, nullable=False, index=True)
+    cutoff = db.Column(db.DateTime, nullable=False)
+    moved = db.Column(db.Integer, nullable=False, default=0)
+    batches = db.Column(db.Integer, nullable=False, default=0)
+    duration_ms = db.Column(db.Integer, nullable=False, default=0)
@@ -0,0 +1,170 @@
+import hashlib
+import math
+import threading
+from flask import current_app
+from app.database import db
+
+
+def name_hash(name):
+    """
+    Хэш имени поста фиксированной длины (sha256, 64 hex-символа):
+    по нему построен уникальный индекс вместо индекса на name.
+    """
+    return hashlib.sha256(name.encode('utf-8')).hexdigest()
+
+
+class BloomFilter(object):
+    """
+    Фильтр Блума над хэшами имен. Ложноположительные ответы возможны
+    (с вероятностью около error_rate при заполнении до capacity),
+    ложноотрицательных нет.
+    """
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.size = max(8, int(-capacity * math.log(error_rate) /
+                               math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def positions(self, hash):
+        # двойное хэширование: обе половины берутся из самого sha256
+        digest = bytes.fromhex(hash)
+        h1 = int.from_bytes(digest[:8], 'big')
+        h2 = int.from_bytes(digest[8:16], 'big') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, hash):
+        for position in self.positions(hash):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, hash):
+        return all(self.bits[position >> 3] & (1 << (position & 7))
+                   for position in self.positions(hash))
+
+
+class PostNames(object):
+    """
+    Быстрая проверка занятости имени поста. Фильтр Блума строится из
+    таблицы posts при первом обращении и пополняется после создания и
+    изменения постов; если имени в фильтре нет - запрос к БД не нужен.
+    Фильтр локален для процесса, поэтому имена из других процессов
+    ловит уникальный индекс (IntegrityError -> 409). Удаленные имена
+    из фильтра не убираются, их отсекает запрос к БД. Имена архивных
+    постов (posts_archive) тоже заняты.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.filter = None
+        self.lock = threading.Lock()
+        self.checks = 0
+        self.skipped = 0
+        self.false_positives = 0
+
+    def init_app(self, app):
+        self.enabled = app.config['NAME_FILTER_ENABLED']
+        self.filter = None
+        self.checks = 0
+        self.skipped = 0
+        self.false_positives = 0
+
+    def ensure_filter(self):
+        if self.filter is not None:
+            return self.filter
+        with self.lock:
+            if self.filter is None:
+                self.filter = self.build()
+        return self.filter
+
+    def build(self):
+        from app.models import ArchivedPost, Post
+        config = current_app.config
+        count = sum(
+                    db.session.query(db.func.count(model.id)).scalar()
+                    for model in (Post, ArchivedPost)
+        )
+        bloom = BloomFilter(
+                            max(config['NAME_FILTER_CAPACITY'], 2 * count),
+                            config['NAME_FILTER_ERROR_RATE']
+        )
+        batch_size = config['API_STREAM_BATCH_SIZE']
+        for model in (Post, ArchivedPost):
+            rows = db.session.query(model.name_hash)
+            for hash, in rows.yield_per(batch_size):
+                bloom.add(hash)
+        return bloom
+
+    def might_exist(self, hash):
+        if not self.enabled:
+            return True
+        self.checks += 1
+        if hash in self.ensure_filter():
+            return True
+        self.skipped += 1
+        return False
+
+    def add(self, *hashes):
+        bloom = self.filter
+        if bloom is None:
+            return
+        for hash in hashes:
+            bloom.add(hash)
+        if bloom.count > bloom.capacity:
+            # переполненный фильтр пересобирается при следующей проверке
+            self.filter = None
+
+    def taken(self, names):
+        """
+        Возвращает множество занятых имен из names.
+        """
+        from app.models import ArchivedPost, Post
+        hashes = {}
+        for name in names:
+            hash = name_hash(name)
+            if self.might_exist(hash):
+                hashes[hash] = name
+        found = set()
+        keys = list(hashes)
+        for model in (Post, ArchivedPost):
+            for i in range(0, len(keys), 500):
+                rows = db.session.query(model.name_hash).filter(
+                                    model.name_hash.in_(keys[i:i + 500]))
+                found.update(hashes[hash] for hash, in rows)
+        if self.enabled:
+            self.false_positives += len(hashes) - len(found)
+        return found
+
+    def is_taken(self, name, exclude_id=None):
+        """
+        Занято ли имя другим постом (кроме поста exclude_id).
+        """
+        from app.models import ArchivedPost, Post
+        hash = name_hash(name)
+        if not self.might_exist(hash):
+            return False
+        id = db.session.query(Post.id).filter(
+                                        Post.name_hash == hash).scalar()
+        if id is None:
+            id = db.session.query(ArchivedPost.id).filter(
+                                    ArchivedPost.name_hash == hash).scalar()
+        if id is None and self.enabled:
+            self.false_positives += 1
+        return id is not None and id != exclude_id
+
+    def stats(self):
+        bloom = self.filter
+        return {
+                'enabled': self.enabled,
+                'loaded': bloom is not None,
+                'size': bloom.count if bloom is not None else 0,
+                'capacity': bloom.capacity if bloom is not None else 0,
+                'checks': self.checks,
+                'skipped': self.skipped,
+                'false_positives': self.false_positives
+        }
+
+
+post_names = PostNames()
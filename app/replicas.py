@@ -0,0 +1,181 @@
+import itertools
+import threading
+import time
+from collections import Counter
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from app.database import db
+
+
+SAFE_METHODS = ('GET', 'HEAD')
+STICKY_COOKIE = 'db_primary_until'
+STICKY_HEADER = 'X-DB-Primary-Until'
+
+
+class ReplicaRouter(object):
+    """
+    Чтение с реплик: GET/HEAD запросы к DB_REPLICA_ENDPOINTS идут на
+    один из bind'ов DB_REPLICA_BINDS (по кругу), остальное - на
+    основную БД. После записи клиент DB_READ_YOUR_WRITES секунд читает
+    с основной БД (cookie db_primary_until или заголовок
+    X-DB-Primary-Until с тем же значением для клиентов без cookie).
+    Реплика проверяется запросом SELECT 1 не чаще раза в
+    DB_REPLICA_CHECK_INTERVAL секунд; недоступная или вернувшая ошибку
+    реплика исключается на тот же интервал, и чтение идет с основной БД.
+    """
+
+    def __init__(self):
+        self._down = {}
+        self._checked = {}
+        self._listening = set()
+        self._next = itertools.count()
+        self._lock = threading.Lock()
+        self.reads = Counter()
+        self.fallbacks = 0
+        self.sticky = 0
+
+    def init_app(self, app):
+        with self._lock:
+            self._down = {}
+            self._checked = {}
+            self._listening = set()
+            self.reads = Counter()
+            self.fallbacks = 0
+            self.sticky = 0
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+
+    @property
+    def binds(self):
+        return current_app.config['DB_REPLICA_BINDS']
+
+    def before_request(self):
+        g.db_replica = None
+        config = current_app.config
+        if not self.binds or request.method not in SAFE_METHODS or \
+                request.endpoint not in config['DB_REPLICA_ENDPOINTS']:
+            return
+        if self.primary_until() > time.time():
+            self.sticky += 1
+            return
+        g.db_replica = self.choose()
+        with self._lock:
+            if g.db_replica is None:
+                self.fallbacks += 1
+            else:
+                self.reads[g.db_replica] += 1
+
+    def primary_until(self):
+        """
+        Время, до которого клиент читает с основной БД. Значение
+        приходит от клиента: выданное сервером не бывает позже, чем
+        через DB_READ_YOUR_WRITES секунд, более позднее игнорируется -
+        иначе клиент мог бы навсегда закрепить чтение за основной БД.
+        """
+        value = request.headers.get(STICKY_HEADER) or \
+            request.cookies.get(STICKY_COOKIE)
+        try:
+            until = float(value)
+        except (TypeError, ValueError):
+            return 0
+        window = current_app.config['DB_READ_YOUR_WRITES']
+        if until > time.time() + window:
+            return 0
+        return until
+
+    def choose(self):
+        binds = self.binds
+        start = next(self._next)
+        for i in range(len(binds)):
+            bind = binds[(start + i) % len(binds)]
+            if self.healthy(bind):
+                return bind
+        return None
+
+    def healthy(self, bind):
+        now = time.monotonic()
+        interval = current_app.config['DB_REPLICA_CHECK_INTERVAL']
+        with self._lock:
+            if now < self._down.get(bind, 0):
+                return False
+            checked = self._checked.get(bind)
+        if checked is not None and now - checked < interval:
+            return True
+        engine = self.engine(bind)
+        try:
+            with engine.connect() as connection:
+                connection.scalar('SELECT 1')
+        except Exception:
+            self.mark_down(bind)
+            return False
+        with self._lock:
+            self._checked[bind] = now
+        return True
+
+    def mark_down(self, bind):
+        interval = current_app.config['DB_REPLICA_CHECK_INTERVAL']
+        with self._lock:
+            self._down[bind] = time.monotonic() + interval
+            self._checked.pop(bind, None)
+
+    def engine(self, bind):
+        engine = db.get_engine(current_app, bind)
+        with self._lock:
+            if engine not in self._listening:
+                self._listening.add(engine)
+                event.listen(
+                            engine,
+                            'handle_error',
+                            lambda context: self.mark_down(bind)
+                )
+        return engine
+
+    def engine_for(self, session, mapper=None):
+        """
+        Движок реплики для запроса сессии или None - основная БД. Если
+        в сессии есть несохраненные изменения, чтение идет с основной БД.
+        """
+        if not has_request_context():
+            return None
+        bind = g.get('db_replica')
+        if bind is None:
+            return None
+        if mapper is not None and \
+                mapper.persist_selectable.info.get('bind_key') is not None:
+            return None
+        if session._flushing or session.new or session.dirty or \
+                session.deleted:
+            return None
+        return self.engine(bind)
+
+    def after_request(self, response):
+        if not self.binds:
+            return response
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            window = current_app.config['DB_READ_YOUR_WRITES']
+            until = '{:.3f}'.format(time.time() + window)
+            response.set_cookie(
+                                STICKY_COOKIE,
+                                until,
+                                max_age=window,
+                                httponly=True
+            )
+            response.headers[STICKY_HEADER] = until
+        return response
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            return {
+                    'binds': list(current_app.config['DB_REPLICA_BINDS']),
+                    'down': sorted(
+                        bind for bind, until in self._down.items()
+                        if until > now
+                    ),
+                    'reads': dict(self.reads),
+                    'fallbacks': self.fallbacks,
+                    'sticky': self.sticky
+            }
+
+
+replica_router = ReplicaRouter()
@@ -0,0 +1,287 @@
+import json
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import func, literal
+from app.database import db
+
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+INDEX_VERSION = 2
+WATERMARK_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def tokenize(text):
+    tokens = TOKEN_RE.findall(text.lower())
+    return [token for token in tokens if len(token) > 1]
+
+
+class InvertedIndex(object):
+    """
+    Инвертированный индекс в памяти с ранжированием BM25.
+    postings: терм -> {id документа: частота терма в документе}.
+    """
+
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = {}
+        self.doc_terms = {}
+        self.doc_len = {}
+        self.total_len = 0
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.doc_len)
+
+    def add(self, doc_id, text):
+        counts = Counter(tokenize(text))
+        with self.lock:
+            self.remove(doc_id)
+            for term, tf in counts.items():
+                self.postings.setdefault(term, {})[doc_id] = tf
+            self.doc_terms[doc_id] = tuple(counts)
+            self.doc_len[doc_id] = sum(counts.values())
+            self.total_len += self.doc_len[doc_id]
+
+    def remove(self, doc_id):
+        with self.lock:
+            for term in self.doc_terms.pop(doc_id, ()):
+                docs = self.postings[term]
+                del docs[doc_id]
+                if not docs:
+                    del self.postings[term]
+            self.total_len -= self.doc_len.pop(doc_id, 0)
+
+    def search(self, query, limit=20):
+        """
+        Возвращает список (id документа, score) по убыванию score.
+        """
+        terms = set(tokenize(query))
+        scores = Counter()
+        with self.lock:
+            count = len(self.doc_len)
+            if not count:
+                return []
+            avg_len = self.total_len / count
+            for term in terms:
+                docs = self.postings.get(term)
+                if not docs:
+                    continue
+                df = len(docs)
+                idf = math.log(1 + (count - df + 0.5) / (df + 0.5))
+                for doc_id, tf in docs.items():
+                    norm = 1 - self.b + self.b * self.doc_len[doc_id] / avg_len
+                    scores[doc_id] += \
+                        idf * tf * (self.k1 + 1) / (tf + self.k1 * norm)
+        return scores.most_common(limit)
+
+    def save(self, path, **meta):
+        """
+        Сохраняет индекс в JSON (только данные, в отличие от pickle
+        загрузка файла не выполняет код). meta - значения JSON.
+        """
+        with self.lock:
+            state = {
+                    'version': INDEX_VERSION,
+                    'postings': {
+                        term: list(docs.items())
+                        for term, docs in self.postings.items()
+                    },
+                    'doc_len': list(self.doc_len.items()),
+                    'meta': meta
+            }
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(state, f, separators=(',', ':'))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Возвращает (индекс, meta) или None, если файла нет или он
+        другой версии.
+        """
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, encoding='utf-8') as f:
+                state = json.load(f)
+        except ValueError:
+            return None
+        if not isinstance(state, dict) or \
+                state.get('version') != INDEX_VERSION:
+            return None
+        index = cls()
+        doc_terms = {}
+        for term, docs in state['postings'].items():
+            index.postings[term] = dict(docs)
+            for doc_id, _ in docs:
+                doc_terms.setdefault(doc_id, []).append(term)
+        index.doc_terms = {
+                doc_id: tuple(terms) for doc_id, terms in doc_terms.items()
+        }
+        index.doc_len = dict(state['doc_len'])
+        index.total_len = sum(index.doc_len.values())
+        return index, state['meta']
+
+
+def post_text(name, content):
+    return '{} {}'.format(name, content)
+
+
+class PostSearch(object):
+    """
+    Полнотекстовый поиск по постам. SEARCH_BACKEND = 'memory' -
+    инвертированный индекс в процессе, который обновляется при создании,
+    изменении и удалении постов и сохраняется в SEARCH_INDEX_PATH для
+    быстрого старта; 'postgres' - tsvector + GIN индекс в PostgreSQL.
+    """
+
+    def __init__(self):
+        self.index = None
+        self.watermark = None
+        self.checked_at = 0
+        self.lock = threading.Lock()
+
+    def init_app(self, app):
+        self.index = None
+        self.watermark = None
+        self.checked_at = 0
+
+    @property
+    def backend(self):
+        return current_app.config['SEARCH_BACKEND']
+
+    def ensure_index(self):
+        if self.index is not None:
+            return self.index
+        with self.lock:
+            if self.index is None:
+                self.watermark = self.max_updated()
+                self.checked_at = time.monotonic()
+                self.index = self.load() or self.build()
+        return self.index
+
+    def max_updated(self):
+        from app.models import Post
+        return db.session.query(func.max(Post.updated)).scalar()
+
+    def build(self):
+        from app.models import Post
+        index = InvertedIndex()
+        batch_size = current_app.config['API_STREAM_BATCH_SIZE']
+        rows = db.session.query(Post.id, Post.name, Post.content)
+        for id, name, content in rows.yield_per(batch_size):
+            index.add(id, post_text(name, content))
+        return index
+
+    def overlap(self, watermark):
+        """
+        updated ставится по часам сервера приложения до commit'а, поэтому
+        пост, закоммиченный позже, может иметь updated меньше watermark.
+        Перечитываются посты за последние SEARCH_REFRESH_OVERLAP секунд
+        до watermark - повторное добавление в индекс ничего не меняет.
+        """
+        margin = current_app.config['SEARCH_REFRESH_OVERLAP']
+        return watermark - timedelta(seconds=margin)
+
+    def catch_up(self):
+        """
+        Индекс локален для процесса: раз в SEARCH_REFRESH_INTERVAL секунд
+        в него добавляются посты, измененные другими процессами. Удаленные
+        другими процессами посты убираются из индекса при поиске.
+        """
+        from app.models import Post
+        interval = current_app.config['SEARCH_REFRESH_INTERVAL']
+        if time.monotonic() - self.checked_at < interval:
+            return
+        self.checked_at = time.monotonic()
+        watermark = self.watermark
+        rows = db.session.query(
+                                Post.id,
+                                Post.name,
+                                Post.content,
+                                Post.updated
+        )
+        if watermark is not None:
+            rows = rows.filter(Post.updated > self.overlap(watermark))
+        for id, name, content, updated in rows:
+            self.index.add(id, post_text(name, content))
+            if updated is not None and \
+                    (watermark is None or updated > watermark):
+                watermark = updated
+        self.watermark = watermark
+
+    def load(self):
+        """
+        Загружает индекс с диска и догоняет изменения, сделанные после
+        его сохранения: переиндексирует посты с updated позже
+        сохраненного и удаляет из индекса посты, которых больше нет.
+        """
+        from app.models import Post
+        path = current_app.config['SEARCH_INDEX_PATH']
+        loaded = path and InvertedIndex.load(path)
+        if not loaded:
+            return None
+        index, meta = loaded
+        changed = db.session.query(Post.id, Post.name, Post.content)
+        if meta.get('updated') is not None:
+            updated = datetime.strptime(meta['updated'], WATERMARK_FORMAT)
+            changed = changed.filter(Post.updated > self.overlap(updated))
+        for id, name, content in changed:
+            index.add(id, post_text(name, content))
+        ids = {id for id, in db.session.query(Post.id)}
+        for id in set(index.doc_len) - ids:
+            index.remove(id)
+        return index
+
+    def save(self):
+        index = self.ensure_index()
+        path = current_app.config['SEARCH_INDEX_PATH']
+        updated = self.watermark
+        if updated is not None:
+            updated = updated.strftime(WATERMARK_FORMAT)
+        index.save(path, updated=updated)
+        return len(index)
+
+    def rebuild(self):
+        with self.lock:
+            self.watermark = self.max_updated()
+            self.checked_at = time.monotonic()
+            self.index = self.build()
+        return self.index
+
+    def index_post(self, id, name, content):
+        if self.backend == 'memory' and self.index is not None:
+            self.index.add(id, post_text(name, content))
+
+    def remove_post(self, id):
+        if self.backend == 'memory' and self.index is not None:
+            self.index.remove(id)
+
+    def search(self, query, limit):
+        if self.backend == 'postgres':
+            return self.search_postgres(query, limit)
+        index = self.ensure_index()
+        self.catch_up()
+        return index.search(query, limit)
+
+    def search_postgres(self, query, limit):
+        from app.models import Post
+        config = literal(current_app.config['SEARCH_PG_CONFIG'])
+        vector = func.to_tsvector(config, Post.name + ' ' + Post.content)
+        tsquery = func.plainto_tsquery(config, query)
+        rank = func.ts_rank(vector, tsquery)
+        rows = db.session.query(Post.id, rank).filter(
+                    vector.op('@@')(tsquery)
+        ).order_by(rank.desc()).limit(limit)
+        return [(id, score) for id, score in rows]
+
+
+post_search = PostSearch()
@@ -0,0 +1,103 @@
+import threading
+import time
+from datetime import datetime
+from flask import current_app
+from itsdangerous import URLSafeSerializer, BadSignature
+from app.database import db
+
+
+class SignedTokens(object):
+    """
+    Подписанные токены API (HMAC на SECRET_KEY): id пользователя, время
+    выдачи и срок действия хранятся в самом токене, поэтому проверка не
+    обращается к БД. Отзыв - "все токены пользователя, выданные до
+    момента отзыва". Список отзывов хранится в памяти и в таблице
+    token_revocations; память перечитывается из БД не чаще, чем раз в
+    API_TOKEN_DENYLIST_REFRESH секунд. Просроченные токены отклоняются
+    до проверки списка отзывов.
+    """
+
+    def __init__(self):
+        self._revoked = {}
+        self._refreshed = 0
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        with self._lock:
+            self._revoked = {}
+            self._refreshed = 0
+
+    def serializer(self):
+        return URLSafeSerializer(
+                                current_app.config['SECRET_KEY'],
+                                salt='api-token'
+        )
+
+    def issue(self, user_id, expires_in):
+        max_age = current_app.config['API_TOKEN_EXPIRES_IN']
+        expires_in = min(expires_in, max_age)
+        now = time.time()
+        payload = {'id': user_id, 'iat': now, 'exp': now + expires_in}
+        return self.serializer().dumps(payload)
+
+    def verify(self, token):
+        """
+        Возвращает id пользователя или None.
+        """
+        try:
+            payload = self.serializer().loads(token)
+            user_id, issued, expires = \
+                payload['id'], payload['iat'], payload['exp']
+        except (BadSignature, KeyError, TypeError):
+            return None
+        if expires < time.time():
+            return None
+        if self.is_revoked(user_id, issued):
+            return None
+        return user_id
+
+    def is_revoked(self, user_id, issued):
+        self.refresh()
+        with self._lock:
+            revoked = self._revoked.get(user_id)
+        return revoked is not None and issued <= revoked[0]
+
+    def revoke(self, user_id):
+        from app.models import TokenRevocation
+        now = time.time()
+        expires = now + current_app.config['API_TOKEN_EXPIRES_IN']
+        with self._lock:
+            self._revoked[user_id] = (now, expires)
+        db.session.merge(TokenRevocation(
+                            user_id=user_id,
+                            revoked_at=datetime.utcfromtimestamp(now),
+                            expires_at=datetime.utcfromtimestamp(expires)
+        ))
+
+    def refresh(self):
+        from app.models import TokenRevocation
+        now = time.time()
+        interval = current_app.config['API_TOKEN_DENYLIST_REFRESH']
+        if now - self._refreshed < interval:
+            return
+        rows = TokenRevocation.query.filter(
+                TokenRevocation.expires_at > datetime.utcfromtimestamp(now)
+        ).all()
+        epoch = datetime.utcfromtimestamp(0)
+        revoked = {
+                row.user_id: (
+                    (row.revoked_at - epoch).total_seconds(),
+                    (row.expires_at - epoch).total_seconds()
+                )
+                for row in rows
+        }
+        with self._lock:
+            for user_id, entry in self._revoked.items():
+                if entry[1] > now and entry[0] > \
+                        revoked.get(user_id, (0, 0))[0]:
+                    revoked[user_id] = entry
+            self._revoked = revoked
+            self._refreshed = now
+
+
+signed_tokens = SignedTokens()
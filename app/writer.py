@@ -0,0 +1,181 @@
+import queue
+import threading
+import time
+from collections import Counter
+from sqlalchemy.exc import IntegrityError
+from app.database import db
+
+
+class GroupCommitTimeout(Exception):
+    pass
+
+
+class PendingInsert(object):
+
+    def __init__(self, row):
+        self.row = row
+        self.id = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class GroupCommitWriter(object):
+    """
+    Групповой commit вставок постов: запросы кладут строки в очередь,
+    фоновый поток собирает их в пачку (до API_GROUP_COMMIT_MAX_ROWS
+    строк или API_GROUP_COMMIT_MAX_DELAY секунд с первой строки) и
+    вставляет одной транзакцией, то есть с одним commit'ом на пачку.
+    Каждый запрос ждет commit'а своей пачки и получает свой id или
+    свою ошибку: если пачка не вставилась целиком (IntegrityError),
+    строки вставляются по одной. Запрос ждет не дольше
+    API_GROUP_COMMIT_TIMEOUT секунд (GroupCommitTimeout), ошибки пачки
+    не останавливают фоновый поток.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.max_rows = 1
+        self.max_delay = 0
+        self.timeout = None
+        self.app = None
+        self.queue = None
+        self.thread = None
+        self.lock = threading.Lock()
+        self.batches = 0
+        self.rows = 0
+
+    def init_app(self, app):
+        self.stop()
+        self.app = app
+        self.enabled = app.config['API_GROUP_COMMIT_ENABLED']
+        self.max_rows = app.config['API_GROUP_COMMIT_MAX_ROWS']
+        self.max_delay = app.config['API_GROUP_COMMIT_MAX_DELAY']
+        self.timeout = app.config['API_GROUP_COMMIT_TIMEOUT']
+        self.batches = 0
+        self.rows = 0
+
+    def start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.queue = queue.Queue()
+                self.thread = threading.Thread(
+                                            target=self.run,
+                                            args=(self.queue,),
+                                            daemon=True
+                )
+                self.thread.start()
+
+    def stop(self):
+        with self.lock:
+            if self.thread is not None:
+                self.queue.put(None)
+                self.thread.join()
+                self.thread = None
+
+    def insert(self, row):
+        """
+        Ставит строку таблицы posts в очередь и ждет commit'а. Возвращает
+        id поста, при совпадении имени поднимает IntegrityError, если
+        пачка не записана за timeout секунд - GroupCommitTimeout (строка
+        может быть вставлена позже).
+        """
+        self.start()
+        pending = PendingInsert(row)
+        self.queue.put(pending)
+        if not pending.done.wait(self.timeout):
+            raise GroupCommitTimeout('group commit timed out')
+        if pending.error is not None:
+            raise pending.error
+        return pending.id
+
+    def run(self, pending_queue):
+        stopped = False
+        while not stopped:
+            first = pending_queue.get()
+            if first is None:
+                return
+            batch = [first]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_rows:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    pending = pending_queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if pending is None:
+                    stopped = True
+                    break
+                batch.append(pending)
+            try:
+                with self.app.app_context():
+                    self.write(batch)
+            except Exception:
+                self.app.logger.exception('group commit failed')
+
+    def write(self, batch):
+        try:
+            try:
+                self.write_batch(batch)
+            except IntegrityError:
+                db.session.rollback()
+                for pending in batch:
+                    self.write_one(pending)
+        except Exception as e:
+            for pending in batch:
+                if pending.id is None and pending.error is None:
+                    pending.error = e
+            db.session.rollback()
+        finally:
+            try:
+                for pending in batch:
+                    if pending.id is None and pending.error is None:
+                        pending.error = GroupCommitTimeout(
+                                                    'group commit failed')
+                    pending.done.set()
+            finally:
+                db.session.remove()
+
+    def write_batch(self, batch):
+        from app.counts import adjust_post_counts
+        from app.models import Post
+        rows = [pending.row for pending in batch]
+        db.session.execute(Post.__table__.insert(), rows)
+        ids = dict(db.session.query(Post.name_hash, Post.id).filter(
+                    Post.name_hash.in_([row['name_hash'] for row in rows])))
+        adjust_post_counts(Counter(row['user_id'] for row in rows))
+        db.session.commit()
+        for pending in batch:
+            pending.id = ids[pending.row['name_hash']]
+        self.batches += 1
+        self.rows += len(batch)
+
+    def write_one(self, pending):
+        from app.counts import adjust_post_counts
+        from app.models import Post
+        try:
+            result = db.session.execute(
+                            Post.__table__.insert().values(**pending.row))
+            adjust_post_counts({pending.row['user_id']: 1})
+            db.session.commit()
+        except IntegrityError as e:
+            db.session.rollback()
+            pending.error = e
+            return
+        pending.id = result.inserted_primary_key[0]
+        self.batches += 1
+        self.rows += 1
+
+    def stats(self):
+        return {
+                'enabled': self.enabled,
+                'queued': self.queue.qsize() if self.queue else 0,
+                'batches': self.batches,
+                'rows': self.rows,
+                'rows_per_batch': self.rows / self.batches
+                if self.batches else 0.0
+        }
+
+
+post_writer = GroupCommitWriter()
@@ -0,0 +1,69 @@
+"""
+Размер ответа и затраты CPU на сжатие для списка постов
+(JSON, как в GET /api/posts) и HTML-страницы main.index.
+
+    python benchmarks/bench_compression.py [число постов]
+"""
+import gzip
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from app.compress import brotli, zstandard  # noqa: E402
+
+
+def payloads(count):
+    posts = [{
+            'id': i,
+            'timestamp': 'Sat, 18 Oct 2026 10:12:31 GMT',
+            'user_id': i % 50,
+            'name': 'Post name {}'.format(i),
+            'content': 'Lorem ipsum dolor sit amet, post {} '.format(i) * 8
+    } for i in range(count)]
+    html = ''.join(
+        '<p>post id: {id} user id: {user_id} time UTC: {timestamp}</p>'
+        '<p>{name}</p><p>{content}</p><br>'.format(**post)
+        for post in posts
+    )
+    return [
+            ('json', json.dumps(posts, separators=(',', ':')).encode()),
+            ('html', html.encode())
+    ]
+
+
+def codecs():
+    yield 'gzip-1', lambda data: gzip.compress(data, compresslevel=1)
+    yield 'gzip-6', lambda data: gzip.compress(data, compresslevel=6)
+    yield 'gzip-9', lambda data: gzip.compress(data, compresslevel=9)
+    if brotli is not None:
+        for quality in (1, 4, 11):
+            yield 'br-{}'.format(quality), \
+                lambda data, q=quality: brotli.compress(data, quality=q)
+    if zstandard is not None:
+        for level in (1, 3, 19):
+            compressor = zstandard.ZstdCompressor(level=level)
+            yield 'zstd-{}'.format(level), compressor.compress
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    for kind, data in payloads(count):
+        print('{} posts as {}: {} bytes'.format(count, kind, len(data)))
+        for name, func in codecs():
+            start = time.perf_counter()
+            compressed = func(data)
+            elapsed = (time.perf_counter() - start) * 1000
+            print('  {:<8} {:>10} bytes  ratio {:>6.1f}  {:>8.2f} ms'.format(
+                    name,
+                    len(compressed),
+                    len(data) / len(compressed),
+                    elapsed
+            ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Скорость создания постов (POST /api/posts) из параллельных потоков:
+commit на каждый пост и групповой commit (API_GROUP_COMMIT_ENABLED).
+База - файл SQLite во временном каталоге, чтобы commit действительно
+писал на диск.
+
+    python benchmarks/bench_group_commit.py [потоков] [постов на поток]
+"""
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('APP_SETTINGS', 'config.ProductionConfig')
+TMPDIR = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(TMPDIR, 'bench.db')
+
+from requests.auth import _basic_auth_str  # noqa: E402
+from app import create_app  # noqa: E402
+from app.database import db  # noqa: E402
+from app.models import Post, User  # noqa: E402
+from app.writer import post_writer  # noqa: E402
+
+
+def run(app, threads, per_thread, prefix):
+    headers = {'Authorization': _basic_auth_str('bench', 'bench')}
+    errors = []
+
+    def worker(n):
+        client = app.test_client()
+        for i in range(per_thread):
+            response = client.post(
+                path='/api/posts',
+                data=json.dumps({
+                    'name': '{} {} {}'.format(prefix, n, i),
+                    'content': 'content'
+                }),
+                headers=headers,
+                content_type='application/json'
+            )
+            if response.status_code != 201:
+                errors.append(response.status_code)
+
+    workers = [threading.Thread(target=worker, args=(n,))
+               for n in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return threads * per_thread / elapsed, errors
+
+
+def main():
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    per_thread = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    app = create_app()
+    app.config['API_ADMISSION_ENABLED'] = False
+    with app.app_context():
+        user = User(username='bench', email='bench@mail.com')
+        user.set_password('bench')
+        db.session.add(user)
+        db.session.commit()
+    print('{} threads x {} posts'.format(threads, per_thread))
+    for enabled in (False, True):
+        app.config['API_GROUP_COMMIT_ENABLED'] = enabled
+        post_writer.init_app(app)
+        rate, errors = run(app, threads, per_thread, 'group' if enabled
+                           else 'direct')
+        name = 'group commit' if enabled else 'commit per post'
+        print('{:<18} {:>9.0f} inserts/s   errors: {}'.format(
+                                                name, rate, len(errors)))
+        if enabled:
+            stats = post_writer.stats()
+            print('{:<18} {:>9.1f} rows/batch'.format(
+                                        '', stats['rows_per_batch']))
+    post_writer.stop()
+    with app.app_context():
+        print('posts in table: {}'.format(Post.query.count()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""
+Сравнение сериализации списка постов: старый путь (объекты ORM +
+jsonify) и новый (кортежи колонок + app.api.serializers).
+
+    python benchmarks/bench_serializers.py [число постов]
+"""
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('APP_SETTINGS', 'config.ProductionConfig')
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+from flask import current_app, jsonify  # noqa: E402
+from app import create_app  # noqa: E402
+from app.database import db  # noqa: E402
+from app.models import Post, User  # noqa: E402
+from app.names import name_hash  # noqa: E402
+from app.api.serializers import POST_FIELDS, post_columns, \
+    serialize_post, json_response  # noqa: E402
+
+
+def fill(count):
+    user = User(username='bench', email='bench@mail.com')
+    db.session.add(user)
+    db.session.commit()
+    rows = [{
+            'user_id': user.id,
+            'name': 'name {}'.format(i),
+            'name_hash': name_hash('name {}'.format(i)),
+            'content': 'content {} '.format(i) * 20
+    } for i in range(count)]
+    db.session.execute(Post.__table__.insert(), rows)
+    db.session.commit()
+
+
+def orm_jsonify():
+    data = []
+    for post in Post.query.all():
+        data.append({
+                    'id': post.id,
+                    'timestamp': post.timestamp,
+                    'user_id': post.user_id,
+                    'name': post.name,
+                    'content': post.content
+        })
+    return jsonify(data)
+
+
+def column_tuples(encoder):
+    def run():
+        current_app.config['API_JSON_ENCODER'] = encoder
+        rows = db.session.query(*post_columns(POST_FIELDS))
+        return json_response([serialize_post(row) for row in rows])
+    return run
+
+
+def measure(name, func, repeat=3):
+    best = None
+    for _ in range(repeat):
+        db.session.expunge_all()
+        start = time.perf_counter()
+        response = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    size = len(response.get_data())
+    print('{:<28} {:>8.3f} s {:>12} bytes'.format(name, best, size))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    app = create_app()
+    with app.test_request_context():
+        fill(count)
+        print('{} posts'.format(count))
+        measure('ORM objects + jsonify', orm_jsonify)
+        measure('column tuples + json', column_tuples('json'))
+        measure('column tuples + auto', column_tuples('auto'))
+
+
+if __name__ == '__main__':
+    main()
@@ -3,6 +3,9 @@ from flask_script import Manager
 from flask_migrate import Migrate, MigrateCommand
 from app import create_app
 from app.database import db
+from app.search import post_search
+from app.counts import reconcile_post_counts
+from app.archive import archive_posts as archive_old_posts
 
 
 app = create_app()
@@ -13,5 +16,38 @@ migrate = Migrate(app, db)
 manager.add_command('db', MigrateCommand)
 
 
+@manager.command
+def search_index():
+    """Rebuild the full-text search index and save it to disk"""
+    post_search.rebuild()
+    count = post_search.save()
+    print('Indexed {} posts into {}'.format(
+                                count,
+                                app.config['SEARCH_INDEX_PATH']
+    ))
+
+
+@manager.option('-b', '--batch-size', dest='batch_size', type=int,
+                default=1000)
+def reconcile_counts(batch_size):
+    """Recompute cached post counters from the posts table"""
+    count = reconcile_post_counts(batch_size)
+    print('Reconciled {} post counters'.format(count))
+
+
+@manager.option('-d', '--days', dest='days', type=int, default=None)
+@manager.option('-b', '--batch-size', dest='batch_size', type=int,
+                default=None)
+def archive_posts(days, batch_size):
+    """Move posts older than ARCHIVE_AFTER_DAYS into posts_archive"""
+    run = archive_old_posts(days, batch_size)
+    print('Archived {} posts older than {} in {} batches ({} ms)'.format(
+                                run.moved,
+                                run.cutoff,
+                                run.batches,
+                                run.duration_ms
+    ))
+
+
 if __name__ == '__main__':
     manager.run()
@@ -0,0 +1,27 @@
+"""add posts.updated
+
+Revision ID: 3c1f8a2d9b64
+Revises: ff9148434139
+Create Date: 2026-10-18 10:12:31.402117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c1f8a2d9b64'
+down_revision = 'ff9148434139'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('posts', sa.Column('updated', sa.DateTime(), nullable=True))
+    op.execute('UPDATE posts SET updated = timestamp')
+    op.create_index(op.f('ix_posts_updated'), 'posts', ['updated'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_posts_updated'), table_name='posts')
+    op.drop_column('posts', 'updated')
@@ -0,0 +1,37 @@
+"""add post_counts
+
+Revision ID: 4d6f0b8e1c93
+Revises: c7d41f6e2a58
+Create Date: 2026-10-18 19:02:11.407351
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4d6f0b8e1c93'
+down_revision = 'c7d41f6e2a58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('post_counts',
+    sa.Column('user_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+    op.execute(
+        'INSERT INTO post_counts (user_id, count) '
+        'SELECT user_id, COUNT(*) FROM posts '
+        'WHERE user_id IS NOT NULL GROUP BY user_id'
+    )
+    op.execute(
+        'INSERT INTO post_counts (user_id, count) '
+        'SELECT 0, COUNT(*) FROM posts'
+    )
+
+
+def downgrade():
+    op.drop_table('post_counts')
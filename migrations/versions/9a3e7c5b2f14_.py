@@ -0,0 +1,74 @@
+"""replace unique index on posts.name with posts.name_hash
+
+Revision ID: 9a3e7c5b2f14
+Revises: 4d6f0b8e1c93
+Create Date: 2026-10-18 20:11:37.852094
+
+"""
+import hashlib
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a3e7c5b2f14'
+down_revision = '4d6f0b8e1c93'
+branch_labels = None
+depends_on = None
+
+# Имя безымянного UNIQUE (name) из первой миграции в разных СУБД
+NAME_CONSTRAINTS = {'postgresql': 'posts_name_key', 'mysql': 'name'}
+SQLITE_NAMING = {'uq': 'uq_%(table_name)s_%(column_0_name)s'}
+
+
+def upgrade():
+    op.add_column('posts', sa.Column('name_hash', sa.String(length=64), nullable=True))
+    bind = op.get_bind()
+    if bind.dialect.name == 'postgresql':
+        # хэш считается в БД одним UPDATE (sha256() - PostgreSQL 11+)
+        op.execute(
+            "UPDATE posts SET name_hash = "
+            "encode(sha256(convert_to(name, 'UTF8')), 'hex')"
+        )
+    else:
+        backfill_name_hash(bind)
+    if bind.dialect.name == 'sqlite':
+        with op.batch_alter_table('posts', naming_convention=SQLITE_NAMING) as batch_op:
+            batch_op.drop_constraint('uq_posts_name', type_='unique')
+            batch_op.alter_column('name_hash', existing_type=sa.String(length=64), nullable=False)
+            batch_op.create_index(batch_op.f('ix_posts_name_hash'), ['name_hash'], unique=True)
+    else:
+        op.drop_constraint(NAME_CONSTRAINTS.get(bind.dialect.name, 'posts_name_key'), 'posts', type_='unique')
+        op.alter_column('posts', 'name_hash', existing_type=sa.String(length=64), nullable=False)
+        op.create_index(op.f('ix_posts_name_hash'), 'posts', ['name_hash'], unique=True)
+
+
+def backfill_name_hash(bind, batch_size=1000):
+    # остальные СУБД: хэш считается в Python, UPDATE - executemany
+    # на пачку строк
+    posts = sa.table('posts', sa.column('id'), sa.column('name'), sa.column('name_hash'))
+    update = posts.update().where(posts.c.id == sa.bindparam('post_id')).values(
+        name_hash=sa.bindparam('hash')
+    )
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.select([posts.c.id, posts.c.name])
+            .where(posts.c.id > last_id)
+            .order_by(posts.c.id)
+            .limit(batch_size)
+        ).fetchall()
+        if not rows:
+            break
+        bind.execute(update, [
+            {'post_id': id, 'hash': hashlib.sha256(name.encode('utf-8')).hexdigest()}
+            for id, name in rows
+        ])
+        last_id = rows[-1][0]
+
+
+def downgrade():
+    with op.batch_alter_table('posts') as batch_op:
+        batch_op.drop_index(batch_op.f('ix_posts_name_hash'))
+        batch_op.create_unique_constraint('uq_posts_name', ['name'])
+        batch_op.drop_column('name_hash')
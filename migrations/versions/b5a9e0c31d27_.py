@@ -0,0 +1,33 @@
+"""add full-text search index on posts (PostgreSQL only)
+
+Revision ID: b5a9e0c31d27
+Revises: 8e2b5d4c7a10
+Create Date: 2026-10-18 16:41:07.275903
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b5a9e0c31d27'
+down_revision = '8e2b5d4c7a10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Выражение должно совпадать с запросом в app/search.py
+    # (SEARCH_PG_CONFIG = 'simple'), иначе индекс не будет использоваться
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute(
+        "CREATE INDEX ix_posts_fts ON posts USING gin "
+        "(to_tsvector('simple', name || ' ' || content))"
+    )
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.drop_index('ix_posts_fts', table_name='posts')
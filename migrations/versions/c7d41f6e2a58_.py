@@ -0,0 +1,24 @@
+"""add composite index on posts (user_id, timestamp)
+
+Revision ID: c7d41f6e2a58
+Revises: b5a9e0c31d27
+Create Date: 2026-10-18 18:20:44.530162
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7d41f6e2a58'
+down_revision = 'b5a9e0c31d27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_posts_user_id_timestamp', 'posts', ['user_id', 'timestamp'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_posts_user_id_timestamp', table_name='posts')
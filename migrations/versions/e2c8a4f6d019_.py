@@ -0,0 +1,25 @@
+"""add posts.version
+
+Revision ID: e2c8a4f6d019
+Revises: 9a3e7c5b2f14
+Create Date: 2026-10-18 21:05:48.613290
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2c8a4f6d019'
+down_revision = '9a3e7c5b2f14'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('posts', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('posts') as batch_op:
+        batch_op.drop_column('version')
@@ -0,0 +1,60 @@
+"""add posts_archive and archive_runs
+
+Revision ID: f1b3d5a7c9e2
+Revises: 5b7d9f1e3a26
+Create Date: 2026-10-18 23:41:52.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f1b3d5a7c9e2'
+down_revision = '5b7d9f1e3a26'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('posts_archive',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('name', sa.String(length=1000), nullable=False),
+    sa.Column('name_hash', sa.String(length=64), nullable=False),
+    sa.Column('content', sa.String(length=5000), nullable=False),
+    sa.Column('timestamp', sa.DateTime(), nullable=True),
+    sa.Column('updated', sa.DateTime(), nullable=True),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('version', sa.Integer(), server_default='1', nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_posts_archive_name_hash'), 'posts_archive', ['name_hash'], unique=True)
+    op.create_index(op.f('ix_posts_archive_timestamp'), 'posts_archive', ['timestamp'], unique=False)
+    op.create_index('ix_posts_archive_user_id_timestamp', 'posts_archive', ['user_id', 'timestamp'], unique=False)
+    op.create_table('archive_runs',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('started_at', sa.DateTime(), nullable=False),
+    sa.Column('cutoff', sa.DateTime(), nullable=False),
+    sa.Column('moved', sa.Integer(), nullable=False),
+    sa.Column('batches', sa.Integer(), nullable=False),
+    sa.Column('duration_ms', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_archive_runs_started_at'), 'archive_runs', ['started_at'], unique=False)
+
+
+def downgrade():
+    # архивные посты возвращаются в posts
+    op.execute(
+        'INSERT INTO posts (id, name, name_hash, content, timestamp, '
+        'updated, user_id, version) '
+        'SELECT id, name, name_hash, content, timestamp, updated, '
+        'user_id, version FROM posts_archive'
+    )
+    op.drop_index(op.f('ix_archive_runs_started_at'), table_name='archive_runs')
+    op.drop_table('archive_runs')
+    op.drop_index('ix_posts_archive_user_id_timestamp', table_name='posts_archive')
+    op.drop_index(op.f('ix_posts_archive_timestamp'), table_name='posts_archive')
+    op.drop_index(op.f('ix_posts_archive_name_hash'), table_name='posts_archive')
+    op.drop_table('posts_archive')
@@ -1,12 +1,23 @@
 import unittest
 from app.database import db
 from app import create_app
-from app.models import Post, User
+from app.models import ArchivedPost, Post, PostCount, User
+from app.cache import post_cache, token_cache, credential_cache
+from app.tokens import signed_tokens
+from app.api.admission import admission
+from app.api.idempotency import idempotency, request_fingerprint
+from app.search import post_search
+from app.counts import increment_counter, reconcile_post_counts
+from app.archive import archive_posts
+from app.names import BloomFilter, name_hash, post_names
+from app.writer import post_writer
 import json
 from flask_login import current_user
 from requests.auth import _basic_auth_str
 import base64
+import gzip
 import os
+import tempfile
 
 
 class UserPostModelCase(unittest.TestCase):
@@ -550,6 +561,7 @@ class ApiPostCase(unittest.TestCase):
         self.app = create_app()
         self.app.config['TESTING'] = True
         self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        self.app.config['API_INTERNAL_USERS'] = ['bob']
         self.app_context = self.app.app_context()
         self.app_context.push()
         self.client = self.app.test_client()
@@ -569,6 +581,35 @@ class ApiPostCase(unittest.TestCase):
         db.session.remove()
         db.drop_all()
 
+    def internal_stats(self, name, client=None, auth=('bob', '321')):
+        client = client or self.client
+        response = client.get(
+                    path='/api/_internal/' + name,
+                    headers={'Authorization': _basic_auth_str(*auth)}
+        )
+        return response.get_json()
+
+    def test_internal_stats_auth(self):
+        """
+        Тестируем доступ к служебной статистике.
+        """
+        response = self.client.get(path='/api/_internal/cache')
+        self.assertEqual(response.status_code, 401)
+        response = self.client.get(
+                    path='/api/_internal/cache',
+                    headers={'Authorization': _basic_auth_str('john', '123')}
+        )
+        self.assertEqual(response.status_code, 403)
+        token = self.client.post(
+                    path='/api/tokens',
+                    headers={'Authorization': _basic_auth_str('bob', '321')}
+        ).get_json()['token']
+        response = self.client.get(
+                    path='/api/_internal/cache',
+                    headers={'Authorization': 'Bearer ' + token}
+        )
+        self.assertEqual(response.status_code, 200)
+
     def test_get_all_posts(self):
         """
         Тестируем запрос на получение всех постов.
@@ -1222,6 +1263,1307 @@ class ApiPostCase(unittest.TestCase):
         self.assertEqual(data_get_all[1]['name'], 'name 2')
         self.assertEqual(data_get_all[1]['content'], 'content 2')
 
+    def test_get_posts_keyset_pagination(self):
+        """
+        Тестируем постраничное получение постов по курсору.
+        """
+        response = self.client.get(
+                                    path='/api/posts?limit=1',
+                                    content_type='application/json'
+        )
+        data = response.get_json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(data), 1)
+        self.assertEqual(data[0]['name'], 'name 1')
+        self.assertIn('rel="next"', response.headers['Link'])
+        cursor = response.headers['X-Next-Cursor']
+        # вторая (последняя) страница
+        response = self.client.get(
+                                    path='/api/posts?limit=1&cursor=' + cursor,
+                                    content_type='application/json'
+        )
+        data = response.get_json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(data), 1)
+        self.assertEqual(data[0]['name'], 'name 2')
+        self.assertNotIn('Link', response.headers)
+        # недействительный курсор
+        response = self.client.get(
+                                    path='/api/posts?cursor=bad',
+                                    content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
+        # недопустимый размер страницы
+        for limit in ('abc', '0', '-1'):
+            response = self.client.get(
+                                        path='/api/posts?limit=' + limit,
+                                        content_type='application/json'
+            )
+            self.assertEqual(response.status_code, 400)
+        # полный список без пагинации
+        response = self.client.get(
+                                    path='/api/posts?all=1&limit=1',
+                                    content_type='application/json'
+        )
+        self.assertEqual(len(response.get_json()), 2)
+
+    def test_get_posts_ndjson_stream(self):
+        """
+        Тестируем потоковую выгрузку постов в формате NDJSON.
+        """
+        for kwargs in (
+                {'path': '/api/posts?stream=1'},
+                {
+                    'path': '/api/posts',
+                    'headers': {'Accept': 'application/x-ndjson'}
+                }):
+            response = self.client.get(**kwargs)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.mimetype, 'application/x-ndjson')
+            lines = response.get_data(as_text=True).splitlines()
+            self.assertEqual(len(lines), 2)
+            self.assertEqual(json.loads(lines[0])['name'], 'name 1')
+            self.assertEqual(json.loads(lines[1])['name'], 'name 2')
+
+    def test_conditional_get(self):
+        """
+        Тестируем ETag и условные GET запросы (ответ 304).
+        """
+        response = self.client.get(path='/api/posts/2')
+        etag = response.headers['ETag']
+        last_modified = response.headers['Last-Modified']
+        response = self.client.get(
+                                path='/api/posts/2',
+                                headers={'If-None-Match': etag}
+        )
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.get_data(), b'')
+        response = self.client.get(
+                                path='/api/posts/2',
+                                headers={'If-Modified-Since': last_modified}
+        )
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get(path='/api/posts')
+        collection_etag = response.headers['ETag']
+        response = self.client.get(
+                                path='/api/posts',
+                                headers={'If-None-Match': collection_etag}
+        )
+        self.assertEqual(response.status_code, 304)
+        # после изменения поста ETag'и должны измениться
+        data = {'name': 'updated name 2', 'content': 'updated content 2'}
+        headers = {'Authorization': _basic_auth_str('bob', '321')}
+        self.client.put(
+                        path='/api/posts/2',
+                        data=json.dumps(data),
+                        headers=headers,
+                        content_type='application/json'
+        )
+        response = self.client.get(
+                                path='/api/posts/2',
+                                headers={'If-None-Match': etag}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['name'], 'updated name 2')
+        response = self.client.get(
+                                path='/api/posts',
+                                headers={'If-None-Match': collection_etag}
+        )
+        self.assertEqual(response.status_code, 200)
+        # удаление не последнего поста не меняет MAX(id) и
+        # MAX(updated) - ETag меняет счетчик изменений коллекции
+        collection_etag = response.headers['ETag']
+        self.client.delete(
+                    path='/api/posts/1',
+                    headers={'Authorization': _basic_auth_str('john', '123')}
+        )
+        response = self.client.get(
+                                path='/api/posts',
+                                headers={'If-None-Match': collection_etag}
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_single_post_cache(self):
+        """
+        Тестируем кэш постов: попадания, промахи и инвалидацию.
+        """
+        self.client.get(path='/api/posts/2')
+        self.client.get(path='/api/posts/2')
+        stats = self.internal_stats('cache')
+        self.assertEqual(stats['post_cache']['misses'], 1)
+        self.assertEqual(stats['post_cache']['hits'], 1)
+        # изменение поста должно удалять его из кэша
+        data = {'name': 'updated name 2', 'content': 'updated content 2'}
+        headers = {'Authorization': _basic_auth_str('bob', '321')}
+        self.client.put(
+                        path='/api/posts/2',
+                        data=json.dumps(data),
+                        headers=headers,
+                        content_type='application/json'
+        )
+        response = self.client.get(path='/api/posts/2')
+        self.assertEqual(response.get_json()['name'], 'updated name 2')
+        # удаление поста тоже
+        self.client.delete(path='/api/posts/2', headers=headers)
+        response = self.client.get(path='/api/posts/2')
+        self.assertEqual(response.status_code, 404)
+        # вытеснение давно не использованных записей
+        post_cache.maxsize = 1
+        self.client.get(path='/api/posts/1')
+        post_cache.set(3, 'value')
+        self.assertIsNone(post_cache.get(1))
+        self.assertEqual(post_cache.stats()['size'], 1)
+        self.assertEqual(post_cache.stats()['evictions'], 1)
+
+    def test_create_posts_batch(self):
+        """
+        Тестируем пакетное создание постов одной транзакцией.
+        """
+        headers = {'Authorization': _basic_auth_str('bob', '321')}
+        data = [
+                {'name': 'name 3', 'content': 'content 3'},
+                {'name': 'name 1', 'content': 'duplicate'},
+                {'name': 'name 4', 'content': 'content 4'},
+                {'name': 'name 4', 'content': 'duplicate'}
+        ]
+        response = self.client.post(
+                                    path='/api/posts/batch',
+                                    data=json.dumps(data),
+                                    headers=headers,
+                                    content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 207)
+        results = response.get_json()
+        self.assertEqual(
+                        [result['status'] for result in results],
+                        [201, 409, 201, 409]
+        )
+        post = Post.query.get(results[0]['id'])
+        self.assertEqual(post.name, 'name 3')
+        self.assertEqual(post.user_id, 2)
+        self.assertIsNotNone(post.timestamp)
+        self.assertEqual(Post.query.count(), 4)
+        # NDJSON
+        ndjson = '\n'.join(json.dumps({
+                                    'name': 'ndjson {}'.format(i),
+                                    'content': 'content'
+        }) for i in range(3))
+        response = self.client.post(
+                                    path='/api/posts/batch',
+                                    data=ndjson,
+                                    headers=headers,
+                                    content_type='application/x-ndjson'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Post.query.count(), 7)
+        # ошибка валидации - ничего не создается
+        data = [{'name': 'name 5', 'content': 'content 5'}, {'name': 'x'}]
+        response = self.client.post(
+                                    path='/api/posts/batch',
+                                    data=json.dumps(data),
+                                    headers=headers,
+                                    content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()[1]['status'], 400)
+        self.assertEqual(Post.query.count(), 7)
+        # слишком длинные имя или содержимое
+        data = [
+                {'name': 'name 5', 'content': 'content 5'},
+                {'name': 'x' * 1001, 'content': 'content'},
+                {'name': 'name 6', 'content': 'x' * 5001}
+        ]
+        response = self.client.post(
+                                    path='/api/posts/batch',
+                                    data=json.dumps(data),
+                                    headers=headers,
+                                    content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+                        [result['status'] for result in response.get_json()],
+                        [424, 400, 400]
+        )
+        self.assertEqual(Post.query.count(), 7)
+        # без аутентификации
+        response = self.client.post(
+                                    path='/api/posts/batch',
+                                    data=json.dumps(data),
+                                    content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 401)
+
+    def test_prefer_return_minimal(self):
+        """
+        Тестируем заголовок Prefer: return=minimal для POST, PUT и DELETE.
+        """
+        headers = {
+                'Authorization': _basic_auth_str('bob', '321'),
+                'Prefer': 'return=minimal'
+        }
+        data = {'name': 'name 3', 'content': 'content 3'}
+        response = self.client.post(
+                                    path='/api/posts',
+                                    data=json.dumps(data),
+                                    headers=headers,
+                                    content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.get_data(), b'')
+        self.assertTrue(response.headers['Location'].endswith('/api/posts/3'))
+        self.assertEqual(
+                        response.headers['Preference-Applied'],
+                        'return=minimal'
+        )
+        data = {'name': 'updated name 3', 'content': 'updated content 3'}
+        response = self.client.put(
+                                    path='/api/posts/3',
+                                    data=json.dumps(data),
+                                    headers=headers,
+                                    content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(Post.query.get(3).name, 'updated name 3')
+        response = self.client.delete(path='/api/posts/3', headers=headers)
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(response.get_data(), b'')
+        self.assertEqual(Post.query.count(), 2)
+        # без полного списка постов после удаления; Prefer без return -
+        # без Preference-Applied
+        self.app.config['API_DELETE_RELIST'] = False
+        headers = {
+                'Authorization': _basic_auth_str('bob', '321'),
+                'Prefer': 'respond-async'
+        }
+        response = self.client.delete(path='/api/posts/2', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['name'], 'name 2')
+        self.assertNotIn('Preference-Applied', response.headers)
+
+    def test_sparse_fieldsets(self):
+        """
+        Тестируем выборку только запрошенных полей (?fields=).
+        """
+        response = self.client.get(path='/api/posts?fields=id,name')
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()
+        self.assertEqual(data[0], {'id': 1, 'name': 'name 1'})
+        self.assertEqual(data[1], {'id': 2, 'name': 'name 2'})
+        response = self.client.get(path='/api/posts/2?fields=content')
+        self.assertEqual(response.get_json(), {'content': 'content 2'})
+        # из кэша поля тоже выбираются
+        self.client.get(path='/api/posts/2')
+        response = self.client.get(path='/api/posts/2?fields=id,user_id')
+        self.assertEqual(response.get_json(), {'id': 2, 'user_id': 2})
+        response = self.client.get(path='/api/posts?stream=1&fields=name')
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertEqual(json.loads(lines[1]), {'name': 'name 2'})
+        response = self.client.get(path='/api/posts?limit=1&fields=name')
+        self.assertEqual(response.get_json(), [{'name': 'name 1'}])
+        self.assertIn('X-Next-Cursor', response.headers)
+        response = self.client.get(path='/api/posts?fields=password')
+        self.assertEqual(response.status_code, 400)
+
+    def test_serializers(self):
+        """
+        Тестируем сериализатор постов: формат timestamp должен совпадать
+        с форматом jsonify, стандартный json - запасной вариант.
+        """
+        from werkzeug.http import http_date
+        from app.api.serializers import format_timestamp, serialize_post
+        post = Post.query.get(1)
+        self.assertEqual(
+                        format_timestamp(post.timestamp),
+                        http_date(post.timestamp)
+        )
+        self.assertEqual(
+                        serialize_post(post, ('id', 'name')),
+                        {'id': 1, 'name': 'name 1'}
+        )
+        self.app.config['API_JSON_ENCODER'] = 'json'
+        response = self.client.get(path='/api/posts/1')
+        data = response.get_json()
+        self.assertEqual(data['timestamp'], http_date(post.timestamp))
+        self.assertEqual(data['content'], 'content 1')
+
+    def test_response_compression(self):
+        """
+        Тестируем сжатие ответов по заголовку Accept-Encoding.
+        """
+        self.app.config['COMPRESS_MIN_SIZE'] = 0
+        headers = {'Accept-Encoding': 'gzip'}
+        response = self.client.get(path='/api/posts', headers=headers)
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+        data = json.loads(gzip.decompress(response.get_data()))
+        self.assertEqual(data[1]['name'], 'name 2')
+        # сжатое представление имеет свой ETag, условный запрос с ним
+        # возвращает 304
+        etag = response.headers['ETag']
+        self.assertTrue(etag.endswith('-gzip"'))
+        headers['If-None-Match'] = etag
+        response = self.client.get(path='/api/posts', headers=headers)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers['ETag'], etag)
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+        # HTML тоже сжимается
+        response = self.client.get(
+                            path='/main/',
+                            headers={'Accept-Encoding': 'gzip'}
+        )
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertIn(b'name 1', gzip.decompress(response.get_data()))
+        # без Accept-Encoding и для маленьких ответов - без сжатия
+        response = self.client.get(path='/api/posts')
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.app.config['COMPRESS_MIN_SIZE'] = 100000
+        response = self.client.get(
+                            path='/api/posts',
+                            headers={'Accept-Encoding': 'gzip'}
+        )
+        self.assertNotIn('Content-Encoding', response.headers)
+        # потоковые ответы не сжимаются
+        response = self.client.get(
+                            path='/api/posts?stream=1',
+                            headers={'Accept-Encoding': 'gzip'}
+        )
+        self.assertNotIn('Content-Encoding', response.headers)
+
+    def test_token_cache(self):
+        """
+        Тестируем кэш токенов: повторная проверка токена без запроса к БД,
+        отзыв токена сразу удаляет его из кэша.
+        """
+        headers = {'Authorization': _basic_auth_str('bob', '321')}
+        token = self.client.post(path='/api/tokens', headers=headers).json
+        headers = {"Authorization": "Bearer {token}".format(**token)}
+        for i in range(3, 5):
+            data = {'name': 'name {}'.format(i), 'content': 'content'}
+            response = self.client.post(
+                                    path='/api/posts',
+                                    data=json.dumps(data),
+                                    headers=headers,
+                                    content_type='application/json'
+            )
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(response.get_json()['user_id'], 2)
+        self.assertEqual(token_cache.stats()['misses'], 1)
+        self.assertEqual(token_cache.stats()['hits'], 1)
+        # отзываем токен через кэшированного пользователя
+        response = self.client.delete(path='/api/tokens', headers=headers)
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(token_cache.stats()['size'], 0)
+        response = self.client.post(
+                                    path='/api/posts',
+                                    data=json.dumps(data),
+                                    headers=headers,
+                                    content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 401)
+
+    def test_credential_cache(self):
+        """
+        Тестируем кэш успешных проверок пароля для базовой аутентификации.
+        """
+        headers = {'Authorization': _basic_auth_str('bob', '321')}
+        for i in range(3):
+            response = self.client.post(path='/api/tokens', headers=headers)
+            self.assertEqual(response.status_code, 200)
+        stats = credential_cache.stats()
+        self.assertEqual(stats['hits'], 2)
+        self.assertEqual(stats['size'], 1)
+        # неверный пароль не кэшируется и не проходит
+        bad_headers = {'Authorization': _basic_auth_str('bob', '***')}
+        response = self.client.post(path='/api/tokens', headers=bad_headers)
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(credential_cache.stats()['size'], 1)
+        # смена пароля удаляет записи из кэша
+        user = User.query.filter_by(username='bob').first()
+        user.set_password('new')
+        db.session.commit()
+        self.assertEqual(credential_cache.stats()['size'], 0)
+        response = self.client.post(path='/api/tokens', headers=headers)
+        self.assertEqual(response.status_code, 401)
+
+    def test_signed_tokens(self):
+        """
+        Тестируем подписанные токены: проверка без таблицы user,
+        отзыв и истечение срока действия.
+        """
+        self.app.config['API_TOKEN_BACKEND'] = 'signed'
+        self.app.config['API_TOKEN_DENYLIST_REFRESH'] = 0
+        headers = {'Authorization': _basic_auth_str('bob', '321')}
+        token = self.client.post(path='/api/tokens', headers=headers).json
+        self.assertIsNone(User.query.get(2).token)
+        headers = {"Authorization": "Bearer {token}".format(**token)}
+        data = {'name': 'name 3', 'content': 'content 3'}
+        response = self.client.post(
+                                    path='/api/posts',
+                                    data=json.dumps(data),
+                                    headers=headers,
+                                    content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.get_json()['user_id'], 2)
+        # подделанный токен
+        bad_headers = {"Authorization": "Bearer {}x".format(token['token'])}
+        response = self.client.delete(path='/api/posts/3', headers=bad_headers)
+        self.assertEqual(response.status_code, 401)
+        # отзыв токена
+        response = self.client.delete(path='/api/tokens', headers=headers)
+        self.assertEqual(response.status_code, 204)
+        response = self.client.delete(path='/api/posts/3', headers=headers)
+        self.assertEqual(response.status_code, 401)
+        # отзыв виден после перечитывания списка из БД
+        signed_tokens.init_app(self.app)
+        response = self.client.delete(path='/api/posts/3', headers=headers)
+        self.assertEqual(response.status_code, 401)
+        # новый токен работает, просроченный - нет
+        token = signed_tokens.issue(2, 3600)
+        headers = {"Authorization": "Bearer {}".format(token)}
+        response = self.client.delete(path='/api/posts/3', headers=headers)
+        self.assertEqual(response.status_code, 202)
+        token = signed_tokens.issue(2, -1)
+        headers = {"Authorization": "Bearer {}".format(token)}
+        response = self.client.delete(path='/api/posts/2', headers=headers)
+        self.assertEqual(response.status_code, 401)
+
+    def test_admission_control(self):
+        """
+        Тестируем ограничение числа одновременных запросов к API:
+        при отсутствии свободного места - быстрый ответ 503.
+        """
+        self.app.config['API_ADMISSION_LIMITS'] = {'read': 1, 'write': 1}
+        self.app.config['API_ADMISSION_QUEUE_SIZE'] = 0
+        admission.init_app(self.app)
+        # занимаем единственное место для чтения
+        self.assertTrue(admission.budgets['read'].acquire())
+        response = self.client.get(path='/api/posts')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers['Retry-After'], '1')
+        # запись ограничивается отдельно
+        headers = {'Authorization': _basic_auth_str('bob', '321')}
+        response = self.client.delete(path='/api/posts/2', headers=headers)
+        self.assertEqual(response.status_code, 202)
+        stats = self.internal_stats('admission')
+        self.assertEqual(stats['budgets']['read']['rejected'], 1)
+        self.assertEqual(stats['budgets']['read']['in_flight'], 1)
+        self.assertEqual(stats['budgets']['write']['in_flight'], 0)
+        # место освободилось - запросы снова обрабатываются
+        admission.budgets['read'].release()
+        response = self.client.get(path='/api/posts')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(admission.budgets['read'].stats()['in_flight'], 0)
+
+    def test_search_posts(self):
+        """
+        Тестируем полнотекстовый поиск: ранжирование, обновление индекса
+        при изменении и удалении постов, сохранение индекса на диск.
+        """
+        headers = {'Authorization': _basic_auth_str('bob', '321')}
+        data = [
+                {'name': 'flask tips', 'content': 'flask flask blueprints'},
+                {'name': 'cooking', 'content': 'soup with flask of water'}
+        ]
+        self.client.post(
+                        path='/api/posts/batch',
+                        data=json.dumps(data),
+                        headers=headers,
+                        content_type='application/json'
+        )
+        response = self.client.get(path='/api/posts/search?q=Flask')
+        self.assertEqual(response.status_code, 200)
+        results = response.get_json()
+        self.assertEqual(len(results), 2)
+        self.assertEqual(results[0]['name'], 'flask tips')
+        self.assertGreater(results[0]['score'], results[1]['score'])
+        # изменение и удаление постов
+        data = {'name': 'cooking', 'content': 'soup with carrots'}
+        self.client.put(
+                        path='/api/posts/4',
+                        data=json.dumps(data),
+                        headers=headers,
+                        content_type='application/json'
+        )
+        self.client.delete(path='/api/posts/3', headers=headers)
+        response = self.client.get(path='/api/posts/search?q=flask')
+        self.assertEqual(response.get_json(), [])
+        response = self.client.get(
+                            path='/api/posts/search?q=carrots&fields=id')
+        results = response.get_json()
+        self.assertEqual([item['id'] for item in results], [4])
+        self.assertNotIn('name', results[0])
+        response = self.client.get(path='/api/posts/search')
+        self.assertEqual(response.status_code, 400)
+        # сохранение и загрузка индекса
+        with tempfile.TemporaryDirectory() as tmp:
+            self.app.config['SEARCH_INDEX_PATH'] = os.path.join(tmp, 'index')
+            self.assertEqual(post_search.save(), 3)
+            # пост, добавленный после сохранения индекса
+            post = Post(name='late', content='carrots again', user_id=1)
+            db.session.add(post)
+            db.session.commit()
+            post_search.init_app(self.app)
+            response = self.client.get(path='/api/posts/search?q=carrots')
+            ids = [item['id'] for item in response.get_json()]
+            self.assertEqual(sorted(ids), [4, post.id])
+            with open(self.app.config['SEARCH_INDEX_PATH']) as f:
+                self.assertEqual(json.load(f)['version'], 2)
+        # пост другого процесса, закоммиченный после догрузки индекса,
+        # но с updated раньше watermark (часы другого сервера)
+        from datetime import timedelta
+        self.app.config['SEARCH_REFRESH_INTERVAL'] = 0
+        self.client.get(path='/api/posts/search?q=carrots')
+        db.session.execute(Post.__table__.insert(), [{
+                    'name': 'skewed',
+                    'name_hash': name_hash('skewed'),
+                    'content': 'turnips',
+                    'user_id': 1,
+                    'updated': post_search.watermark - timedelta(seconds=10)
+        }])
+        db.session.commit()
+        response = self.client.get(path='/api/posts/search?q=turnips')
+        self.assertEqual(len(response.get_json()), 1)
+
+    def test_filter_posts(self):
+        """
+        Тестируем фильтры по автору и времени и список постов автора.
+        """
+        from datetime import datetime, timedelta
+        post = Post.query.get(1)
+        post.timestamp = datetime(2019, 5, 1, 12, 0, 0)
+        db.session.commit()
+        response = self.client.get(path='/api/posts?user_id=2')
+        data = response.get_json()
+        self.assertEqual([post['id'] for post in data], [2])
+        response = self.client.get(
+                            path='/api/posts?since=2019-05-01T12:00:00')
+        self.assertEqual(len(response.get_json()), 2)
+        until = '2019-05-01T15:00:00%2B02:00'
+        response = self.client.get(path='/api/posts?until=' + until)
+        data = response.get_json()
+        self.assertEqual([post['id'] for post in data], [1])
+        since = (datetime.utcnow() - timedelta(days=1)).isoformat()
+        response = self.client.get(path='/api/posts?since=' + since)
+        self.assertEqual([post['id'] for post in response.get_json()], [2])
+        response = self.client.get(path='/api/posts?since=yesterday')
+        self.assertEqual(response.status_code, 400)
+        # посты одного автора
+        response = self.client.get(path='/api/users/1/posts?fields=id,name')
+        self.assertEqual(response.get_json(), [{'id': 1, 'name': 'name 1'}])
+        response = self.client.get(
+                            path='/api/users/2/posts?until=2019-06-01')
+        self.assertEqual(response.get_json(), [])
+        response = self.client.get(path='/api/users/3/posts')
+        self.assertEqual(response.status_code, 404)
+
+    def test_post_counts(self):
+        """
+        Тестируем счетчики постов и заголовок X-Total-Count.
+        """
+        headers = {'Authorization': _basic_auth_str('bob', '321')}
+        response = self.client.get(path='/api/posts')
+        self.assertEqual(response.headers['X-Total-Count'], '2')
+        self.assertEqual(PostCount.query.count(), 0)
+        data = [
+                {'name': 'name 3', 'content': 'content 3'},
+                {'name': 'name 4', 'content': 'content 4'}
+        ]
+        self.client.post(
+                        path='/api/posts/batch',
+                        data=json.dumps(data),
+                        headers=headers,
+                        content_type='application/json'
+        )
+        self.assertEqual(PostCount.query.get(0).count, 4)
+        self.assertEqual(PostCount.query.get(2).count, 3)
+        self.client.delete(path='/api/posts/2', headers=headers)
+        response = self.client.get(path='/api/posts?limit=1')
+        self.assertEqual(response.headers['X-Total-Count'], '3')
+        response = self.client.get(path='/api/users/2/posts')
+        self.assertEqual(response.headers['X-Total-Count'], '2')
+        response = self.client.get(path='/api/posts?user_id=1')
+        self.assertEqual(response.headers['X-Total-Count'], '1')
+        response = self.client.get(path='/api/posts?since=2019-01-01')
+        self.assertNotIn('X-Total-Count', response.headers)
+        # пересчет по таблице posts
+        PostCount.query.get(2).count = 100
+        db.session.commit()
+        self.assertEqual(reconcile_post_counts(batch_size=1), 3)
+        self.assertEqual(PostCount.query.get(1).count, 1)
+        self.assertEqual(PostCount.query.get(2).count, 2)
+        self.assertEqual(PostCount.query.get(0).count, 3)
+        # строку счетчика успел создать параллельный запрос
+        table = PostCount.__table__
+
+        def concurrent_insert():
+            db.session.execute(table.insert().values(user_id=7, count=10))
+            return 1
+
+        increment_counter(7, 1, concurrent_insert)
+        db.session.commit()
+        self.assertEqual(PostCount.query.get(7).count, 11)
+
+    def test_duplicate_names(self):
+        """
+        Тестируем 409 при совпадении имени поста и фильтр Блума.
+        """
+        headers = {'Authorization': _basic_auth_str('bob', '321')}
+        self.assertEqual(Post.query.get(1).name_hash, name_hash('name 1'))
+        response = self.client.post(
+                    path='/api/posts',
+                    data=json.dumps({'name': 'name 1', 'content': 'text'}),
+                    headers=headers,
+                    content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 409)
+        response = self.client.put(
+                    path='/api/posts/2',
+                    data=json.dumps({'name': 'name 1', 'content': 'text'}),
+                    headers=headers,
+                    content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(Post.query.get(2).name, 'name 2')
+        # новое имя отсекается фильтром без запроса к БД
+        skipped = post_names.skipped
+        response = self.client.post(
+                    path='/api/posts',
+                    data=json.dumps({'name': 'name 3', 'content': 'text'}),
+                    headers=headers,
+                    content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(post_names.skipped, skipped + 1)
+        self.assertTrue(post_names.might_exist(name_hash('name 3')))
+        # имя, которого нет в фильтре (пост другого процесса),
+        # ловит уникальный индекс
+        db.session.execute(Post.__table__.insert(), [{
+                    'name': 'name 4',
+                    'name_hash': name_hash('name 4'),
+                    'content': 'text',
+                    'user_id': 1
+        }])
+        db.session.commit()
+        response = self.client.post(
+                    path='/api/posts',
+                    data=json.dumps({'name': 'name 4', 'content': 'text'}),
+                    headers=headers,
+                    content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(Post.query.filter_by(name='name 4').count(), 1)
+        # имя не строка или тело не объект - 400 до вычисления хэша
+        bodies = ({'name': 123, 'content': 'text'}, [1], 'name')
+        for method, path in (('post', '/api/posts'), ('put', '/api/posts/2')):
+            for body in bodies:
+                response = getattr(self.client, method)(
+                            path=path,
+                            data=json.dumps(body),
+                            headers=headers,
+                            content_type='application/json'
+                )
+                self.assertEqual(response.status_code, 400)
+
+    def test_bloom_filter(self):
+        """
+        Тестируем фильтр Блума.
+        """
+        bloom = BloomFilter(1000, 0.01)
+        hashes = [name_hash('post {}'.format(i)) for i in range(1000)]
+        for hash in hashes:
+            bloom.add(hash)
+        self.assertTrue(all(hash in bloom for hash in hashes))
+        others = [name_hash('other {}'.format(i)) for i in range(1000)]
+        false_positives = sum(hash in bloom for hash in others)
+        self.assertLess(false_positives, 50)
+
+    def test_if_match(self):
+        """
+        Тестируем версии постов и условный PUT с If-Match (412).
+        """
+        headers = {'Authorization': _basic_auth_str('bob', '321')}
+        response = self.client.get(path='/api/posts/2')
+        etag = response.headers['ETag']
+        self.assertEqual(etag, '"2-1"')
+        response = self.client.get(path='/api/posts/2?fields=name')
+        self.assertTrue(response.headers['ETag'].startswith('"2-1-'))
+        data = json.dumps({'name': 'name 2', 'content': 'edited'})
+        headers['If-Match'] = etag
+        response = self.client.put(
+                                path='/api/posts/2',
+                                data=data,
+                                headers=headers,
+                                content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.headers['ETag'], '"2-2"')
+        self.assertEqual(Post.query.get(2).version, 2)
+        # устаревшая версия
+        response = self.client.put(
+                                path='/api/posts/2',
+                                data=data,
+                                headers=headers,
+                                content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 412)
+        # ETag сжатого представления и If-Match: * тоже подходят
+        for if_match in ('"2-2-gzip"', '*'):
+            headers['If-Match'] = if_match
+            response = self.client.put(
+                                path='/api/posts/2',
+                                data=json.dumps({
+                                    'name': 'name 2',
+                                    'content': if_match
+                                }),
+                                headers=headers,
+                                content_type='application/json'
+            )
+            self.assertEqual(response.status_code, 201)
+        self.assertEqual(Post.query.get(2).version, 4)
+        # ETag другого поста не подходит
+        headers['If-Match'] = '"1-4"'
+        response = self.client.put(
+                                path='/api/posts/2',
+                                data=data,
+                                headers=headers,
+                                content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 412)
+
+    def test_patch_post(self):
+        """
+        Тестируем частичное изменение поста (PATCH) одним запросом.
+        """
+        headers = {'Authorization': _basic_auth_str('bob', '321')}
+
+        def patch(id, data):
+            return self.client.patch(
+                                    path='/api/posts/{}'.format(id),
+                                    data=json.dumps(data),
+                                    headers=headers,
+                                    content_type='application/json'
+            )
+
+        response = patch(2, {'content': 'patched'})
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()
+        self.assertEqual(data['name'], 'name 2')
+        self.assertEqual(data['content'], 'patched')
+        self.assertEqual(response.headers['ETag'], '"2-2"')
+        response = patch(2, {'name': 'patched name'})
+        self.assertEqual(response.get_json()['content'], 'patched')
+        post = Post.query.get(2)
+        self.assertEqual(post.name_hash, name_hash('patched name'))
+        self.assertEqual(post.version, 3)
+        self.assertEqual(patch(2, {'name': 'name 1'}).status_code, 409)
+        self.assertEqual(patch(2, {}).status_code, 400)
+        self.assertEqual(patch(2, {'name': 5}).status_code, 400)
+        self.assertEqual(patch(2, 'name').status_code, 400)
+        self.assertEqual(patch(2, 5).status_code, 400)
+        self.assertEqual(patch(1, {'content': 'x'}).status_code, 403)
+        self.assertEqual(patch(5, {'content': 'x'}).status_code, 404)
+        headers['If-Match'] = '"2-2"'
+        self.assertEqual(patch(2, {'content': 'x'}).status_code, 412)
+        headers['If-Match'] = '"2-3"'
+        self.assertEqual(patch(2, {'content': 'x'}).status_code, 200)
+        # DELETE - тоже один запрос с условием на автора и версию
+        response = self.client.delete(path='/api/posts/2', headers=headers)
+        self.assertEqual(response.status_code, 412)
+        del headers['If-Match']
+        self.app.config['API_DELETE_RELIST'] = False
+        response = self.client.delete(path='/api/posts/1', headers=headers)
+        self.assertEqual(response.status_code, 403)
+        response = self.client.delete(path='/api/posts/2', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['content'], 'x')
+        response = self.client.delete(path='/api/posts/2', headers=headers)
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(Post.query.count(), 1)
+
+    def test_group_commit(self):
+        """
+        Тестируем групповой commit при создании постов.
+        """
+        import threading
+        self.app.config['API_GROUP_COMMIT_ENABLED'] = True
+        self.app.config['API_GROUP_COMMIT_MAX_DELAY'] = 0.2
+        post_writer.init_app(self.app)
+        headers = {'Authorization': _basic_auth_str('bob', '321')}
+        response = self.client.post(
+                    path='/api/posts',
+                    data=json.dumps({'name': 'name 3', 'content': 'text'}),
+                    headers=headers,
+                    content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 201)
+        data = response.get_json()
+        self.assertEqual(data['id'], 3)
+        self.assertEqual(data['user_id'], 2)
+        response = self.client.post(
+                    path='/api/posts',
+                    data=json.dumps({'name': 'name 1', 'content': 'text'}),
+                    headers=headers,
+                    content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 409)
+        # параллельные вставки попадают в одну пачку, каждая получает
+        # свой id или свою ошибку
+        results = {}
+
+        def insert(name):
+            try:
+                results[name] = post_writer.insert({
+                                    'user_id': 1,
+                                    'name': name,
+                                    'name_hash': name_hash(name),
+                                    'content': 'text',
+                                    'version': 1
+                })
+            except Exception as e:
+                results[name] = e
+
+        names = ['group {}'.format(i) for i in range(5)]
+        threads = [threading.Thread(target=insert, args=(name,))
+                   for name in names + ['name 2']]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        post_writer.stop()
+        ids = [results[name] for name in names]
+        self.assertEqual(len(set(ids)), 5)
+        self.assertIsInstance(results['name 2'], Exception)
+        for name, id in zip(names, ids):
+            self.assertEqual(Post.query.get(id).name, name)
+        self.assertEqual(Post.query.count(), 8)
+        self.assertEqual(PostCount.query.get(0).count, 8)
+        # без конфликтов пачка вставляется одним commit'ом
+        post_writer.init_app(self.app)
+        threads = [threading.Thread(target=insert, args=(name,))
+                   for name in ('group 5', 'group 6', 'group 7')]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        post_writer.stop()
+        self.assertEqual(post_writer.stats()['batches'], 1)
+        self.assertEqual(post_writer.stats()['rows'], 3)
+        # сбой фонового потока: запрос получает 503 по таймауту,
+        # поток продолжает работать
+        self.app.config['API_GROUP_COMMIT_TIMEOUT'] = 0.3
+        post_writer.init_app(self.app)
+
+        def broken_write(batch):
+            raise RuntimeError('broken')
+
+        post_writer.write = broken_write
+        response = self.client.post(
+                    path='/api/posts',
+                    data=json.dumps({'name': 'lost', 'content': 'text'}),
+                    headers=headers,
+                    content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('Retry-After', response.headers)
+        del post_writer.write
+        insert('group 8')
+        post_writer.stop()
+        self.assertEqual(Post.query.get(results['group 8']).name, 'group 8')
+
+    def test_batch_operations(self):
+        """
+        Тестируем POST /api/batch: одна аутентификация, атомарный и
+        независимый режимы.
+        """
+        headers = {'Authorization': _basic_auth_str('bob', '321')}
+
+        def batch(data):
+            return self.client.post(
+                                    path='/api/batch',
+                                    data=json.dumps(data),
+                                    headers=headers,
+                                    content_type='application/json'
+            )
+
+        response = batch([
+            {'method': 'POST', 'path': '/api/posts',
+             'body': {'name': 'name 3', 'content': 'content 3'}},
+            {'method': 'PATCH', 'path': '/api/posts/2',
+             'body': {'content': 'patched'},
+             'headers': {'If-Match': '"2-1"'}},
+            {'method': 'GET', 'path': '/api/posts/2'}
+        ])
+        self.assertEqual(response.status_code, 200)
+        results = response.get_json()
+        self.assertEqual([r['status'] for r in results], [201, 200, 200])
+        self.assertEqual(results[0]['body']['name'], 'name 3')
+        self.assertEqual(results[0]['location'], '/api/posts/3')
+        self.assertEqual(results[2]['body']['content'], 'patched')
+        self.assertEqual(results[2]['etag'], '"2-2"')
+        # атомарный режим: ошибка откатывает весь пакет
+        response = batch([
+            {'method': 'POST', 'path': '/api/posts',
+             'body': {'name': 'name 4', 'content': 'content 4'}},
+            {'method': 'DELETE', 'path': '/api/posts/2'},
+            {'method': 'DELETE', 'path': '/api/posts/1'},
+            {'method': 'DELETE', 'path': '/api/posts/3'}
+        ])
+        self.assertEqual(response.status_code, 403)
+        results = response.get_json()
+        self.assertEqual(
+                        [r['status'] for r in results],
+                        [424, 424, 403, 424]
+        )
+        self.assertIsNone(Post.query.filter_by(name='name 4').first())
+        self.assertIsNotNone(Post.query.get(2))
+        self.assertEqual(Post.query.count(), 3)
+        # независимый режим: каждая операция отдельно
+        response = batch({'atomic': False, 'operations': [
+            {'method': 'DELETE', 'path': '/api/posts/3'},
+            {'method': 'DELETE', 'path': '/api/posts/1'},
+            {'method': 'GET', 'path': '/api/tokens'},
+            {'method': 'GET', 'path': '/api/posts/3'}
+        ]})
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(
+                        [r['status'] for r in response.get_json()],
+                        [202, 403, 405, 404]
+        )
+        self.assertEqual(Post.query.count(), 2)
+        # тело операции - только объект
+        response = batch({'atomic': False, 'operations': [
+            {'method': 'POST', 'path': '/api/posts', 'body': [1]},
+            {'method': 'GET', 'path': '/api/posts/2'}
+        ]})
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(
+                        [r['status'] for r in response.get_json()],
+                        [400, 200]
+        )
+        # непредвиденная ошибка во view - 500 только для этой операции
+        index_post = post_search.index_post
+
+        def broken_index_post(id, name, content):
+            if name in ('name 5', 'name 6'):
+                raise RuntimeError('index is broken')
+            index_post(id, name, content)
+
+        post_search.index_post = broken_index_post
+        try:
+            response = batch([
+                {'method': 'GET', 'path': '/api/posts/2'},
+                {'method': 'POST', 'path': '/api/posts',
+                 'body': {'name': 'name 5', 'content': 'content 5'}}
+            ])
+            self.assertEqual(response.status_code, 500)
+            self.assertEqual(
+                            [r['status'] for r in response.get_json()],
+                            [424, 500]
+            )
+            self.assertIsNone(Post.query.filter_by(name='name 5').first())
+            response = batch({'atomic': False, 'operations': [
+                {'method': 'POST', 'path': '/api/posts',
+                 'body': {'name': 'name 6', 'content': 'content 6'}},
+                {'method': 'GET', 'path': '/api/posts/2'}
+            ]})
+            self.assertEqual(response.status_code, 207)
+            self.assertEqual(
+                            [r['status'] for r in response.get_json()],
+                            [500, 200]
+            )
+        finally:
+            post_search.index_post = index_post
+        # без аутентификации пакет не выполняется
+        response = self.client.post(
+                    path='/api/batch',
+                    data=json.dumps([{'path': '/api/posts/1'}]),
+                    content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(admission.stats()['budgets']['write']['in_flight'],
+                         0)
+
+    def test_idempotency_key(self):
+        """
+        Тестируем повтор POST /api/posts с заголовком Idempotency-Key.
+        """
+        for use_db in (False, True):
+            self.app.config['IDEMPOTENCY_DB'] = use_db
+            idempotency.init_app(self.app)
+            headers = {
+                    'Authorization': _basic_auth_str('bob', '321'),
+                    'Idempotency-Key': 'key-1'
+            }
+            name = 'idempotent {}'.format(use_db)
+            data = json.dumps({'name': name, 'content': 'text'})
+
+            def create(data=data):
+                return self.client.post(
+                                        path='/api/posts',
+                                        data=data,
+                                        headers=headers,
+                                        content_type='application/json'
+                )
+
+            first = create()
+            self.assertEqual(first.status_code, 201)
+            self.assertNotIn('Idempotent-Replayed', first.headers)
+            count = Post.query.count()
+            replay = create()
+            self.assertEqual(replay.status_code, 201)
+            self.assertEqual(replay.headers['Idempotent-Replayed'], 'true')
+            self.assertEqual(replay.get_json(), first.get_json())
+            self.assertEqual(
+                            replay.headers['Location'],
+                            first.headers['Location']
+            )
+            self.assertEqual(Post.query.count(), count)
+            # тот же ключ с другим телом
+            other = json.dumps({'name': 'other', 'content': 'text'})
+            self.assertEqual(create(other).status_code, 422)
+            # запрос с этим ключом еще выполняется
+            headers['Idempotency-Key'] = 'key-2'
+            fingerprint = request_fingerprint(
+                                        'POST',
+                                        '/api/posts',
+                                        other.encode('utf-8')
+            )
+            state, _ = idempotency.begin(2, 'key-2', fingerprint)
+            self.assertEqual(state, 'new')
+            self.assertEqual(create(other).status_code, 409)
+            idempotency.abandon(2, 'key-2')
+            self.assertEqual(create(other).status_code, 201)
+            Post.query.filter_by(name='other').delete()
+            db.session.commit()
+        # в режиме с БД ответ переживает очистку кэша процесса
+        idempotency.clear()
+        headers['Idempotency-Key'] = 'key-1'
+        replay = create(json.dumps({'name': name, 'content': 'text'}))
+        self.assertEqual(replay.headers['Idempotent-Replayed'], 'true')
+
+    def test_engine_profile(self):
+        """
+        Тестируем профиль движка БД и статистику пула соединений.
+        """
+        from sqlalchemy.engine.url import make_url
+        from sqlalchemy.exc import TimeoutError
+        from sqlalchemy.pool import QueuePool
+        from app.database import pool_stats, session_connect_args
+        options = {
+                'statement_timeout': 5000,
+                'lock_timeout': 2000,
+                'application_name': 'microblog'
+        }
+        self.assertEqual(session_connect_args('postgresql', options), {
+                'options': '-c statement_timeout=5000 -c lock_timeout=2000',
+                'application_name': 'microblog'
+        })
+        self.assertEqual(
+                    session_connect_args('mysql', options)['init_command'],
+                    'SET SESSION max_execution_time=5000, '
+                    'innodb_lock_wait_timeout=2'
+        )
+        self.assertEqual(session_connect_args('sqlite', options),
+                         {'timeout': 2.0})
+        # движок тестов - SQLite в памяти: опции QueuePool отброшены
+        stats = self.internal_stats('db')
+        self.assertEqual(stats['default']['pool'], 'StaticPool')
+        self.assertGreater(stats['default']['acquired'], 0)
+        path = os.path.join(tempfile.mkdtemp(), 'pool.db')
+        engine = db.create_engine(make_url('sqlite:///' + path), {
+                                                'poolclass': QueuePool,
+                                                'pool_size': 1,
+                                                'max_overflow': 0,
+                                                'pool_timeout': 0.01,
+                                                'lock_timeout': 1000
+        })
+        connection = engine.connect()
+        stats = pool_stats(engine)
+        self.assertEqual(stats['pool'], 'QueuePool')
+        self.assertEqual(stats['checked_out'], 1)
+        self.assertEqual(stats['idle'], 0)
+        with self.assertRaises(TimeoutError):
+            engine.connect()
+        connection.close()
+        stats = pool_stats(engine)
+        self.assertEqual(stats['checked_out'], 0)
+        self.assertEqual(stats['idle'], 1)
+        self.assertEqual(stats['timeouts'], 1)
+        engine.dispose()
+
+    def test_read_replica(self):
+        """
+        Тестируем чтение с реплики: две БД SQLite - основная и реплика.
+        """
+        tmp = tempfile.mkdtemp()
+        primary_uri = 'sqlite:///' + os.path.join(tmp, 'primary.db')
+        replica_uri = 'sqlite:///' + os.path.join(tmp, 'replica.db')
+        db.session.remove()
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = primary_uri
+        self.app.config['SQLALCHEMY_BINDS'] = {'replica0': replica_uri}
+        self.app.config['DB_REPLICA_BINDS'] = ['replica0']
+        self.app.config['API_INTERNAL_USERS'] = ['john']
+        post_cache.enabled = False
+        db.create_all()
+        u = User(username="john", email="john@mail.com")
+        u.set_password('123')
+        db.session.add(u)
+        db.session.commit()
+        db.session.add(Post(name="name 1", content="primary", user_id=u.id))
+        db.session.commit()
+        # "репликация": копия основной БД с отставшим содержимым поста
+        replica = db.get_engine(self.app, 'replica0')
+        db.Model.metadata.create_all(replica)
+        for table in db.Model.metadata.sorted_tables:
+            rows = [dict(row) for row in db.session.execute(table.select())]
+            if rows:
+                replica.execute(table.insert(), rows)
+        replica.execute(Post.__table__.update().values(content='replica'))
+        db.session.remove()
+        try:
+            response = self.client.get(path='/api/posts/1')
+            self.assertEqual(response.get_json()['content'], 'replica')
+            self.assertNotIn('X-DB-Primary-Until', response.headers)
+            response = self.client.post(
+                        path='/api/posts',
+                        data=json.dumps({'name': 'new', 'content': 'text'}),
+                        headers={
+                            'Authorization': _basic_auth_str('john', '123')
+                        },
+                        content_type='application/json'
+            )
+            self.assertEqual(response.status_code, 201)
+            until = response.headers['X-DB-Primary-Until']
+            id = response.get_json()['id']
+            # после записи клиент читает с основной БД (cookie)
+            response = self.client.get(path='/api/posts/{}'.format(id))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(
+                    self.client.get(path='/api/posts/1').get_json()['content'],
+                    'primary'
+            )
+            # клиент без cookie: реплика или заголовок X-DB-Primary-Until
+            client = self.app.test_client()
+            response = client.get(path='/api/posts/{}'.format(id))
+            self.assertEqual(response.status_code, 404)
+            response = client.get(
+                                path='/api/posts/{}'.format(id),
+                                headers={'X-DB-Primary-Until': until}
+            )
+            self.assertEqual(response.status_code, 200)
+            # значение дальше окна DB_READ_YOUR_WRITES игнорируется
+            response = client.get(
+                                path='/api/posts/{}'.format(id),
+                                headers={'X-DB-Primary-Until': '1e20'}
+            )
+            self.assertEqual(response.status_code, 404)
+            stats = self.internal_stats('db', client, ('john', '123'))
+            self.assertEqual(stats['replicas']['reads'], {'replica0': 3})
+            self.assertEqual(stats['replicas']['sticky'], 3)
+            self.assertEqual(stats['replica0']['pool'], 'NullPool')
+            # недоступная реплика - чтение с основной БД
+            self.app.config['SQLALCHEMY_BINDS'] = {
+                'replica0': 'sqlite:///' + os.path.join(tmp, 'no', 'x.db')
+            }
+            self.app.config['DB_REPLICA_CHECK_INTERVAL'] = 0
+            response = client.get(path='/api/posts/1')
+            self.assertEqual(response.get_json()['content'], 'primary')
+            stats = self.internal_stats('db', client, ('john', '123'))
+            self.assertEqual(stats['replicas']['fallbacks'], 1)
+        finally:
+            self.app.config['SQLALCHEMY_BINDS'] = {}
+            self.app.config['DB_REPLICA_BINDS'] = []
+            post_cache.enabled = True
+        # без реплик cookie и заголовок не выставляются
+        response = self.client.delete(
+                    path='/api/posts/{}'.format(id),
+                    headers={'Authorization': _basic_auth_str('john', '123')}
+        )
+        self.assertLess(response.status_code, 400)
+        self.assertNotIn('X-DB-Primary-Until', response.headers)
+
+    def test_archive_posts(self):
+        """
+        Тестируем перенос старых постов в архив и чтение архива.
+        """
+        from datetime import datetime, timedelta
+        old = datetime.utcnow() - timedelta(days=400)
+        for i in range(3):
+            db.session.add(Post(
+                            name='old {}'.format(i),
+                            content='old',
+                            user_id=1,
+                            timestamp=old + timedelta(minutes=i)
+            ))
+        Post.query.get(2).timestamp = old - timedelta(days=1)
+        db.session.commit()
+        reconcile_post_counts()
+        run = archive_posts(days=365, batch_size=2)
+        self.assertEqual((run.moved, run.batches), (4, 2))
+        self.assertEqual(Post.query.count(), 1)
+        self.assertEqual(ArchivedPost.query.count(), 4)
+        self.assertEqual(archive_posts(days=365).moved, 0)
+        # чтение поста и списков не зависит от того, где пост
+        response = self.client.get(path='/api/posts/2')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['name'], 'name 2')
+        self.assertEqual(self.client.get(path='/api/posts/99').status_code,
+                         404)
+        names = []
+        path = '/api/posts?limit=2'
+        while path:
+            response = self.client.get(path=path)
+            self.assertEqual(response.headers['X-Total-Count'], '5')
+            names += [post['name'] for post in response.get_json()]
+            cursor = response.headers.get('X-Next-Cursor')
+            path = cursor and '/api/posts?limit=2&cursor=' + cursor
+        self.assertEqual(
+                    names,
+                    ['name 2', 'old 0', 'old 1', 'old 2', 'name 1']
+        )
+        response = self.client.get(path='/api/users/1/posts?fields=name')
+        self.assertEqual(
+                    [post['name'] for post in response.get_json()],
+                    ['old 0', 'old 1', 'old 2', 'name 1']
+        )
+        response = self.client.get(
+                    path='/api/posts?stream=1&user_id=2&since=2000-01-01')
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertEqual([json.loads(line)['name'] for line in lines],
+                         ['name 2'])
+        # архивные посты только для чтения, их имена заняты
+        headers = {'Authorization': _basic_auth_str('bob', '321')}
+        for method in ('put', 'patch', 'delete'):
+            response = getattr(self.client, method)(
+                    path='/api/posts/2',
+                    data=json.dumps({'name': 'new', 'content': 'new'}),
+                    headers=headers,
+                    content_type='application/json'
+            )
+            self.assertEqual(response.status_code, 409)
+        post_names.init_app(self.app)
+        response = self.client.post(
+                    path='/api/posts',
+                    data=json.dumps({'name': 'old 1', 'content': 'text'}),
+                    headers=headers,
+                    content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 409)
+        reconcile_post_counts()
+        self.assertEqual(PostCount.query.get(0).count, 5)
+        stats = self.internal_stats('archive')
+        self.assertEqual(stats['moved'], 4)
+        self.assertEqual(stats['runs'], 2)
+        self.assertEqual(
+                    [run['moved'] for run in stats['last_runs']],
+                    [0, 4]
+        )
+        # HTML лента тоже показывает архивные посты
+        html = self.client.get(path='/main/').get_data(as_text=True)
+        for name in ('name 1', 'name 2', 'old 0', 'old 1', 'old 2'):
+            self.assertIn(name, html)
+
 
 if __name__ == '__main__':
     unittest.main(verbosity=2)